@@ -0,0 +1,84 @@
+"""
+Awaitable versions of api functions. They run in the database
+thread pool, so independent lookups can be awaited with asyncio.gather
+"""
+from db.executor import in_db_thread
+from api import category, checkout, equipment, history, qr_store, transfer, user
+from api.exceptions import UserDoesNotExist
+
+# users
+create_user = in_db_thread(user.create_user)
+get_user = in_db_thread(user.get_user)
+get_user_by_username = in_db_thread(user.get_user_by_username)
+delete_user = in_db_thread(user.delete_user)
+verify_user = in_db_thread(user.verify_user)
+change_username = in_db_thread(user.change_username)
+get_user_equipment = in_db_thread(user.get_user_equipment)
+
+
+async def get_profile(id: int) -> dict:
+    """
+    Profiles are read on the loop: they are cached, and a miss is two
+    lookups by index, which is cheaper than a trip to the thread pool.
+    With WAL readers don't wait for writers
+    """
+    return user.get_profile(id)
+
+
+async def get_admin_list() -> list:
+    return user.get_admin_list()
+
+
+async def is_admin(id: int) -> bool:
+    return (await get_profile(id))['role'] == 'admin'
+
+
+async def is_exists(id: int) -> bool:
+    try:
+        await get_profile(id)
+    except UserDoesNotExist:
+        return False
+    return True
+
+
+async def is_verified(id: int) -> bool:
+    return (await get_profile(id))['role'] in user.VERIFIED_ROLES
+
+# categories
+get_all_categories = in_db_thread(category.get_all_categories)
+get_category_equipment = in_db_thread(category.get_category_equipment)
+get_category_equipment_page = in_db_thread(category.get_category_equipment_page)
+
+# equipment
+add_equipment = in_db_thread(equipment.add_equipment)
+get_equipment = in_db_thread(equipment.get_equipment)
+get_equipment_list = in_db_thread(equipment.get_equipment_list)
+get_equipment_by_holder = in_db_thread(equipment.get_equipment_by_holder)
+get_equipment_by_name = in_db_thread(equipment.get_equipment_by_name)
+get_equipment_payload = in_db_thread(equipment.get_equipment_payload)
+delete_equipment = in_db_thread(equipment.delete_equipment)
+change_equipment_name = in_db_thread(equipment.change_equipment_name)
+change_equipment_description = in_db_thread(equipment.change_equipment_description)
+
+# history
+get_history_page = in_db_thread(history.get_history_page)
+get_user_history = in_db_thread(history.get_user_history)
+get_equipment_history = in_db_thread(history.get_equipment_history)
+get_history_by_period = in_db_thread(history.get_history_by_period)
+get_last_actions = in_db_thread(history.get_last_actions)
+
+# transfers
+create_transfer = in_db_thread(transfer.create_transfer)
+create_transfers = in_db_thread(transfer.create_transfers)
+get_active_transfers = in_db_thread(transfer.get_active_transfers)
+verify_transfers = in_db_thread(transfer.verify_transfers)
+delete_transfers = in_db_thread(transfer.delete_transfers)
+return_all = in_db_thread(transfer.return_all)
+
+# checkouts
+get_overdue_checkouts = in_db_thread(checkout.get_overdue_checkouts)
+
+# QR codes
+get_qr_file_id = in_db_thread(qr_store.get_file_id)
+set_qr_file_id = in_db_thread(qr_store.set_file_id)
+forget_qr_file_id = in_db_thread(qr_store.forget_file_id)
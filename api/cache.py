@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Bounded LRU cache, entries expire after ttl seconds.
+    Counts hits and misses to see how useful the cache is.
+    Safe to use from the loop and database threads at once.
+    Values read from the database are stored with start_load and
+    set_loaded, so a value read before pop or clear is not stored
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._data = OrderedDict()
+        # key: token of the latest load, removed by invalidation
+        self._loads = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._set(key, value)
+
+    def _set(self, key, value):
+        self._data[key] = (value, time.monotonic() + self._ttl)
+        self._data.move_to_end(key)
+        # drop the least recently used entries
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value = self._data.pop(key, None)
+            self._loads.pop(key, None)
+        return default if value is None else value[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._loads.clear()
+
+    def start_load(self, key) -> object:
+        """
+        Call before the value is read, return token of the load
+        """
+        token = object()
+        with self._lock:
+            self._loads[key] = token
+        return token
+
+    def set_loaded(self, key, value, token: object) -> bool:
+        """
+        Store the value unless the key was invalidated or loaded
+        again since the load started
+        """
+        with self._lock:
+            if self._loads.get(key) is not token:
+                return False
+            self._set(key, value)
+        return True
+
+    def end_load(self, key, token: object):
+        with self._lock:
+            if self._loads.get(key) is token:
+                del self._loads[key]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __str__(self):
+        return f'{self.hits} hits, {self.misses} misses ({self.hit_rate:.0%}), {len(self)} entries'
@@ -1,11 +1,17 @@
-from db.models import Category
+from db.models import Category, Equipment
 from .exceptions import *
+from .projections import select_equipment, to_dicts
+from .metrics import timed
 
+PAGE_SIZE = 10
 
+
+@timed
 def create_category(name: str):
     cat = Category.create(name=name)
 
 
+@timed
 def delete_category(id: int):
     try:
         Category.delete().where(Category.id == id).execute()
@@ -13,12 +19,27 @@ def delete_category(id: int):
         raise CategoryDoesNotExist(f'Category with id {id} does not exist')
 
 
+@timed
 def get_category_equipment(id: int) -> list:
-    try:
-        return [eq.get_as_dict() for eq in Category.get(id=id).equipment]
-    except Category.DoesNotExist:
+    if not Category.select().where(Category.id == id).exists():
         raise CategoryDoesNotExist(f'Category with id {id} does not exist')
+    return to_dicts(select_equipment().where(Equipment.category == id).order_by(Equipment.id))
+
+
+@timed
+def get_category_equipment_page(id: int, after: int = 0, before: int = None, count: int = PAGE_SIZE) -> tuple:
+    """
+    Get page of equipment of the category after or before equipment
+    with specific id. Return (rows, has previous page, has next page)
+    """
+    query = select_equipment().where(Equipment.category == id)
+    if before is not None:
+        rows = to_dicts(query.where(Equipment.id < before).order_by(Equipment.id.desc()).limit(count + 1))
+        return rows[:count][::-1], len(rows) > count, True
+    rows = to_dicts(query.where(Equipment.id > after).order_by(Equipment.id).limit(count + 1))
+    return rows[:count], after > 0, len(rows) > count
 
 
+@timed
 def get_all_categories() -> list:
-    return [cat.get_as_dict() for cat in Category.select()]
+    return list(Category.select().order_by(Category.id).dicts())
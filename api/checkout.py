@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+import logging
+
+from peewee import fn
+
+from db.models import db, Checkout, Equipment, History, User
+from .metrics import timed
+
+
+@timed
+def set_holder(equipment_id: int, source_id: int, holder_id: int, date: datetime):
+    """
+    Update current holder of the equipment, call it in the same
+    transaction as the history row is added
+    """
+    set_holders([(equipment_id, source_id, holder_id)], date)
+
+
+@timed
+def set_holders(rows: list, date: datetime):
+    """
+    Update current holders by rows (equipment_id, source_id, holder_id)
+    """
+    returned = [e for e, _, holder in rows if holder == 1]
+    taken = [{'equipment': e, 'holder': h, 'source': s, 'since': date} for e, s, h in rows if h != 1]
+    if returned:
+        Checkout.delete().where(Checkout.equipment.in_(returned)).execute()
+    if taken:
+        Checkout.replace_many(taken).execute()
+
+
+@timed
+def get_holder_checkouts(user_id: int) -> list:
+    return list(Checkout
+                .select(Equipment.id, Equipment.name, Checkout.source, Checkout.since)
+                .join(Equipment)
+                .where(Checkout.holder == user_id)
+                .order_by(Checkout.since)
+                .dicts())
+
+
+@timed
+def get_overdue_checkouts(min_days: int = 1, max_days: int = 7) -> dict:
+    """
+    Find equipment which its current holder has from min_days to
+    max_days and isn't its owner. Unlike get_unreturned_equipment
+    of api.history, equipment passed on from user to user is reported
+    for its last holder.
+    Return {user id: {'username': ..., 'equipment': [{'id': ..., 'name': ...}]}}
+    """
+    now = datetime.now()
+    query = (Checkout
+             .select(User.id, User.username, Equipment.id, Equipment.name)
+             .join(User, on=(Checkout.holder == User.id))
+             .switch(Checkout).join(Equipment)
+             .where((Checkout.since < now - timedelta(days=min_days)) &
+                    (Checkout.since > now - timedelta(days=max_days)) &
+                    (Checkout.holder != Equipment.owner))
+             .order_by(Checkout.since)
+             .tuples())
+    users = {}
+    for user_id, username, equipment_id, name in query:
+        row = users.setdefault(user_id, {'username': username, 'equipment': []})
+        row['equipment'].append({'id': equipment_id, 'name': name})
+    return users
+
+
+@timed
+def rebuild_checkouts():
+    """
+    Recompute current holders from the last history row of every equipment
+    """
+    last_rows = History.select(fn.MAX(History.id)).group_by(History.equipment)
+    with db.atomic('IMMEDIATE'):
+        Checkout.delete().execute()
+        Checkout.insert_from(
+            History
+            .select(History.equipment, History.destination, History.source, History.date)
+            .where(History.id.in_(last_rows) & (History.destination != 1)),
+            [Checkout.equipment, Checkout.holder, Checkout.source, Checkout.since]).execute()
+    logging.info(f'[CHECKOUTS] Rebuilt {Checkout.select().count()} checkouts from history')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    rebuild_checkouts()
@@ -0,0 +1,67 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+from .exceptions import DecoderIsBusy, DecodingTimeout
+from .metrics import Histogram
+
+# decoding runs in worker processes, so it is timed here, queueing included
+decode_seconds = Histogram('qr_decode_seconds', 'Duration of QR code decoding jobs', ['function'])
+
+
+class DecodePool:
+    """
+    Run CPU-bound QR decoding in worker processes so the event loop
+    keeps serving other chats while photos are being processed
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 8, timeout: float = 15):
+        self._workers = workers
+        self._max_queue = max_queue
+        self._timeout = timeout
+        self._executor = None
+        self._pending = 0
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        # workers are spawned lazily, on the first photo
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self._workers)
+        return self._executor
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of jobs that are running or waiting for a free worker
+        """
+        return self._pending
+
+    @property
+    def is_busy(self) -> bool:
+        return self._pending >= self._workers + self._max_queue
+
+    async def run(self, func, *args):
+        """
+        Run func(*args) in a worker process and wait for the result
+        """
+        if self.is_busy:
+            raise DecoderIsBusy(f'Decoder queue is full ({self._pending} jobs)')
+        loop = asyncio.get_event_loop()
+        self._pending += 1
+        future = self.executor.submit(func, *args)
+        # the job holds a worker until it really ends, even after timeout
+        future.add_done_callback(
+            lambda _: loop.call_soon_threadsafe(self._release))
+        try:
+            with decode_seconds.labels(func.__name__).time():
+                return await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(future)), self._timeout)
+        except asyncio.TimeoutError:
+            raise DecodingTimeout(f'Decoding took more than {self._timeout}s')
+
+    def _release(self):
+        self._pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -1,18 +1,24 @@
 from db.models import Equipment, Category, User
-from .qr_code import new_qr_code
+from .projections import select_equipment, to_dict, to_dicts
 from string import ascii_letters
 from random import choice
-from os import remove
 from .exceptions import *
+from .user import invalidate_profiles
+from . import payload
+from .metrics import timed
 
 
+@timed
 def add_equipment(
     category_id: int,
     name: str,
     owner: int = 1,
     description: str = "",
-    qr_code_version: int = 2,
-):
+) -> int:
+    """
+    Add equipment and return its id, QR code is rendered
+    when it is requested for the first time
+    """
     control = "".join([choice(ascii_letters) for _ in range(6)])
     try:
         eq = Equipment.create(
@@ -27,42 +33,67 @@ def add_equipment(
         raise UserDoesNotExist(f'User with id {owner} does not exist')
     except Category.DoesNotExist:
         raise CategoryDoesNotExist(f'Category with id {category_id} does not exist')
-    filename = f'{eq.id}_qr.png'
-    new_qr_code(
-        data_=f'{eq.id} {control}', ver=qr_code_version, size=qr_code_version, filename=filename
-    )
-    return filename
+    invalidate_profiles(1)
+    return eq.id
 
 
-def get_equipment(id: int) -> dict:
+def get_payload(id: int, control: str) -> str:
+    """
+    Data of QR code of the equipment, signed if the secret is set
+    """
+    return payload.sign(id, control) if payload.is_enabled() else f'{id} {control}'
+
+
+@timed
+def get_equipment_payload(id: int) -> str:
     try:
-        return Equipment.get(id=id).get_as_dict()
+        return get_payload(id, Equipment.get(id=id).control)
     except Equipment.DoesNotExist:
         raise EquipmentDoesNotExist(f'Equipment with id {id} does not exist')
 
 
-def get_holder(id: int) -> dict:
-    try:
-        return Equipment.get(id=id).holder.get_as_dict()
-    except Equipment.DoesNotExist:
+@timed
+def get_controls(ids: list) -> dict:
+    """
+    Control values of existing equipment by id
+    """
+    query = Equipment.select(Equipment.id, Equipment.control).where(Equipment.id.in_(ids))
+    return dict(query.tuples())
+
+
+@timed
+def get_equipment(id: int) -> dict:
+    eq = to_dict(select_equipment().where(Equipment.id == id))
+    if eq is None:
         raise EquipmentDoesNotExist(f'Equipment with id {id} does not exist')
+    return eq
+
+
+@timed
+def get_equipment_list(ids: list) -> list:
+    return to_dicts(select_equipment().where(Equipment.id.in_(ids)))
 
 
+@timed
+def get_holder(id: int) -> dict:
+    return get_equipment(id)['holder']
+
+
+@timed
 def get_owner(id: int) -> dict:
-    try:
-        return Equipment.get(id=id).owner.get_as_dict()
-    except Equipment.DoesNotExist:
-        raise EquipmentDoesNotExist(f'Equipment with id {id} does not exist')
+    return get_equipment(id)['owner']
 
 
+@timed
 def delete_equipment(id: int):
     try:
+        invalidate_profiles(Equipment.get(id=id).holder_id)
         Equipment.delete().where(Equipment.id == id).execute()
-        remove(f'./images/qr_codes/{id}_qr.png')
     except Equipment.DoesNotExist:
         raise EquipmentDoesNotExist(f'Equipment with id {id} does not exist')
 
 
+@timed
 def change_equipment_name(id: int, new_name: str) -> bool:
     try:
         eq = Equipment.get(id=id)
@@ -73,6 +104,7 @@ def change_equipment_name(id: int, new_name: str) -> bool:
     return True
 
 
+@timed
 def change_equipment_description(id: int, new_description: str) -> bool:
     try:
         eq = Equipment.get(id=id)
@@ -83,6 +115,7 @@ def change_equipment_description(id: int, new_description: str) -> bool:
     return True
 
 
+@timed
 def change_equipment_category(id: int, new_category: int) -> bool:
     try:
         eq = Equipment.get(id=id)
@@ -93,6 +126,7 @@ def change_equipment_category(id: int, new_category: int) -> bool:
     return True
 
 
+@timed
 def validate_control_sum(id: int, sum: str):
     try:
         return sum == Equipment.get(id=id).control
@@ -100,16 +134,16 @@ def validate_control_sum(id: int, sum: str):
         raise EquipmentDoesNotExist(f'Equipment with id {id} does not exist')
 
 
+@timed
 def get_equipment_by_holder(id: int) -> list:
-    try:
-        holder = User.get(id=id)
-    except User.DoesNotExist:
+    if not User.select().where(User.id == id).exists():
         raise UserDoesNotExist(f'User with id {id} does not exist')
-    return [eq.get_as_dict() for eq in holder.equipment]
+    return to_dicts(select_equipment().where(Equipment.holder == id).order_by(Equipment.id))
 
 
+@timed
 def get_equipment_by_name(name: str) -> dict:
-    try:
-        return Equipment.get(name=name).get_as_dict()
-    except Equipment.DoesNotExist:
+    eq = to_dict(select_equipment().where(Equipment.name == name))
+    if eq is None:
         raise EquipmentDoesNotExist(f'Equipment with name {name} does not exist')
+    return eq
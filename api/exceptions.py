@@ -4,3 +4,6 @@ class EquipmentDoesNotExist(Exception):...
 class HistoryDoesNotExist(Exception):...
 class TransferDoesNotExist(Exception):...
 class ActionDoesNotExist(Exception):...
+class DecoderIsBusy(Exception):...
+class DecodingTimeout(Exception):...
+class ExportFormatIsNotSupported(Exception):...
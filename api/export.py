@@ -0,0 +1,83 @@
+import csv
+from datetime import date
+
+from db.models import Category, Equipment, History
+from api.exceptions import ExportFormatIsNotSupported
+from api.history import history_conditions
+from api.projections import Source, Destination
+from .metrics import timed
+
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+COLUMNS = ('id', 'date', 'equipment_id', 'equipment', 'category',
+           'source_id', 'source', 'destination_id', 'destination')
+
+
+def iter_history(start: date = None, end: date = None):
+    """
+    Yield rows of history as tuples in COLUMNS order, oldest first.
+    Rows are read from the cursor one by one, so memory does not
+    depend on the size of the period
+    """
+    query = (History
+             .select(History.id, History.date, Equipment.id.alias('equipment_id'),
+                     Equipment.name.alias('equipment'), Category.name.alias('category'),
+                     Source.id.alias('source_id'), Source.username.alias('source'),
+                     Destination.id.alias('destination_id'),
+                     Destination.username.alias('destination'))
+             .join(Source, on=(History.source == Source.id))
+             .switch(History).join(Destination, on=(History.destination == Destination.id))
+             .switch(History).join(Equipment, on=(History.equipment == Equipment.id))
+             .join(Category, on=(Equipment.category == Category.id))
+             .order_by(History.date, History.id))
+    conditions = history_conditions(start=start, end=end)
+    if conditions:
+        query = query.where(*conditions)
+    for row in query.dicts().iterator():
+        yield tuple(row[column] for column in COLUMNS)
+
+
+def write_csv(rows, path: str) -> int:
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8-sig') as file:
+        writer = csv.writer(file)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def write_xlsx(rows, path: str) -> int:
+    """
+    Write rows with write only workbook, which keeps only
+    the current row in memory
+    """
+    if Workbook is None:
+        raise ExportFormatIsNotSupported('Install openpyxl to export to xlsx')
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('history')
+    sheet.append(COLUMNS)
+    count = 0
+    for row in rows:
+        sheet.append(row)
+        count += 1
+    workbook.save(path)
+    return count
+
+
+WRITERS = {'csv': write_csv, 'xlsx': write_xlsx}
+
+
+@timed
+def export_history(path: str, start: date = None, end: date = None, file_format: str = 'csv') -> int:
+    """
+    Export history from start to end inclusive into the file,
+    return number of exported rows
+    """
+    if file_format not in WRITERS:
+        raise ExportFormatIsNotSupported(f'Format {file_format} is not supported')
+    return WRITERS[file_format](iter_history(start, end), path)
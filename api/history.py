@@ -1,10 +1,16 @@
 from db.models import User, Equipment, History
 from datetime import datetime, date, timedelta
+from peewee import Tuple, fn
 from api import exceptions
+from api.projections import select_history, to_dict, to_dicts
+from .metrics import timed
 
+PAGE_SIZE = 20
 
-def add_row(equipment_id: int, source_id: int, destination_id: int):
-    row = History.create(
+
+@timed
+def add_row(equipment_id: int, source_id: int, destination_id: int) -> History:
+    return History.create(
         source=User.get(id=source_id),
         destination=User.get(id=destination_id),
         equipment=Equipment.get(equipment_id),
@@ -12,40 +18,151 @@ def add_row(equipment_id: int, source_id: int, destination_id: int):
     )
 
 
+@timed
+def add_rows(rows: list) -> datetime:
+    """
+    Add rows (equipment_id, source_id, destination_id) with one
+    insert, return date of the rows
+    """
+    now = datetime.now()
+    History.insert_many(
+        [{'equipment': e, 'source': s, 'destination': d, 'date': now} for e, s, d in rows]
+    ).execute()
+    return now
+
+
+@timed
 def get_row(id: int) -> dict:
-    try:
-        return History.get(id=id).get_as_dict()
-    except History.DoesNotExist:
+    row = to_dict(select_history().where(History.id == id))
+    if row is None:
         raise exceptions.ActionDoesNotExist(f'Action with id {id} does not exist')
+    return row
+
+
+def history_conditions(user_id: int = None, equipment_id: int = None,
+                       start: date = None, end: date = None) -> list:
+    """
+    Conditions for actions of the user, of the equipment and during
+    days from start to end inclusive, None means any
+    """
+    conditions = []
+    if user_id is not None:
+        conditions.append((History.source == user_id) | (History.destination == user_id))
+    if equipment_id is not None:
+        conditions.append(History.equipment == equipment_id)
+    if start is not None:
+        conditions.append(History.date >= start)
+    if end is not None:
+        conditions.append(History.date < end + timedelta(days=1))
+    return conditions
+
 
+def history_page_query(user_id: int = None, equipment_id: int = None, start: date = None,
+                       end: date = None, before: tuple = None, after: tuple = None,
+                       count: int = PAGE_SIZE):
+    """
+    Query of count + 1 actions by the (date, id) cursor, rows come
+    in any order. Actions of a user are taken from the indexes by
+    source and by destination and merged: with OR of both columns
+    SQLite sorts all actions of the user
+    """
+    key = Tuple(History.date, History.id)
+    conditions = history_conditions(None, equipment_id, start, end)
+    if after is not None:
+        conditions.append(key > Tuple(*after))
+    elif before is not None:
+        conditions.append(key < Tuple(*before))
+    order = (History.date, History.id) if after is not None \
+        else (History.date.desc(), History.id.desc())
+    if user_id is None:
+        query = select_history()
+        return (query.where(*conditions) if conditions else query).order_by(*order).limit(count + 1)
+    page = (History.select(History.id, History.date)
+            .where(History.source == user_id, *conditions)
+            + History.select(History.id, History.date)
+            .where(History.destination == user_id, History.source != user_id, *conditions))
+    page = page.order_by(*order).limit(count + 1).alias('page')
+    return select_history().join_from(History, page, on=(History.id == page.c.id))
 
-def get_user_history(user_id: int, count: int = 20) -> list:
-    try:
-        user = User.get(id=user_id)
-        return [row.get_as_dict() for row in History.select().where((History.source == user) | (History.destination == user)).order_by(History.id.desc()).limit(count)]
-    except User.DoesNotExist:
+
+@timed
+def get_history_page(user_id: int = None, equipment_id: int = None, start: date = None, end: date = None,
+                     before: tuple = None, after: tuple = None, count: int = PAGE_SIZE) -> tuple:
+    """
+    Get page of actions newest first, older than (date, id) cursor
+    before or newer than cursor after.
+    Return (rows, has newer page, has older page)
+    """
+    query = history_page_query(user_id, equipment_id, start, end, before, after, count)
+    rows = sorted(to_dicts(query), key=lambda row: (row['date'], row['id']), reverse=after is None)
+    if after is not None:
+        return rows[:count][::-1], len(rows) > count, True
+    return rows[:count], before is not None, len(rows) > count
+
+
+@timed
+def get_user_history(user_id: int, count: int = PAGE_SIZE) -> list:
+    if not User.select().where(User.id == user_id).exists():
         raise exceptions.UserDoesNotExist(f'User with id {user_id} does not exist')
+    return get_history_page(user_id=user_id, count=count)[0]
 
 
-def get_equipment_history(equipment_id: int, count: int = 20) -> list:
-    try:
-        eq = Equipment.get(id=equipment_id)
-        return [row.get_as_dict() for row in History.select().where(History.equipment == eq).order_by(History.id.desc()).limit(count)]
-    except Equipment.DoesNotExist:
+@timed
+def get_equipment_history(equipment_id: int, count: int = PAGE_SIZE) -> list:
+    if not Equipment.select().where(Equipment.id == equipment_id).exists():
         raise exceptions.EquipmentDoesNotExist(f'Equipment with id {equipment_id} does not exist')
+    return get_history_page(equipment_id=equipment_id, count=count)[0]
 
 
-def get_equipment_history_by_date(equipment_id: int, start_day: int, start_month: int, start_year: int, end_day: int, end_month: int, end_year: int) -> list:
-    try:
-        eq = Equipment.get(id=equipment_id)
-        return [row.get_as_dict() for row in History.select().where((History.equipment == eq) & ((date(day=start_day, month=start_month, year=start_year) <= History.date) & (History.date <= date(day=end_day, month=end_month, year=end_year))))]
-    except Equipment.DoesNotExist:
+@timed
+def get_equipment_history_by_date(equipment_id: int, start_day: int, start_month: int, start_year: int, end_day: int, end_month: int, end_year: int, count: int = PAGE_SIZE) -> list:
+    if not Equipment.select().where(Equipment.id == equipment_id).exists():
         raise exceptions.EquipmentDoesNotExist(f'Equipment with id {equipment_id} does not exist')
+    return get_history_page(equipment_id=equipment_id,
+                            start=date(day=start_day, month=start_month, year=start_year),
+                            end=date(day=end_day, month=end_month, year=end_year), count=count)[0]
 
 
-def get_history_by_period(start_day: int, start_month: int, start_year: int, end_day: int, end_month: int, end_year: int) -> list:
-    return [row.get_as_dict() for row in History.select().where((date(day=start_day, month=start_month, year=start_year) <= History.date) & (History.date <= date(day=end_day, month=end_month, year=end_year)+timedelta(days=1)))]
+@timed
+def get_history_by_period(start_day: int, start_month: int, start_year: int, end_day: int, end_month: int, end_year: int, count: int = PAGE_SIZE) -> list:
+    return get_history_page(start=date(day=start_day, month=start_month, year=start_year),
+                            end=date(day=end_day, month=end_month, year=end_year), count=count)[0]
 
 
+@timed
 def get_last_actions(count: int) -> list:
-    return [row.get_as_dict() for row in History.select().limit(count)]
+    return get_history_page(count=count)[0]
+
+
+@timed
+def get_unreturned_equipment(min_days: int = 1, max_days: int = 7) -> dict:
+    """
+    Find equipment taken from the storehouse from min_days to max_days
+    ago which wasn't returned since then and isn't held by its owner.
+    Return {user id: {'username': ..., 'equipment': [{'id': ..., 'name': ...}]}}
+    grouped by users who took it
+    """
+    now = datetime.now()
+    Returned = History.alias('returned')
+    returned = Returned.select(Returned.id).where(
+        (Returned.equipment == History.equipment) &
+        (Returned.id > History.id) &
+        (Returned.destination == 1))
+    query = (History
+             .select(User.id, User.username, Equipment.id, Equipment.name)
+             .join(User, on=(History.destination == User.id))
+             .switch(History).join(Equipment, on=(History.equipment == Equipment.id))
+             .where((History.source == 1) &
+                    (History.date < now - timedelta(days=min_days)) &
+                    (History.date > now - timedelta(days=max_days)) &
+                    (Equipment.holder != 1) &
+                    (Equipment.holder != Equipment.owner) &
+                    ~fn.EXISTS(returned))
+             .order_by(History.id)
+             .tuples())
+    users = {}
+    for user_id, username, equipment_id, name in query:
+        row = users.setdefault(user_id, {'username': username, 'equipment': []})
+        if all(eq['id'] != equipment_id for eq in row['equipment']):
+            row['equipment'].append({'id': equipment_id, 'name': name})
+    return users
@@ -0,0 +1,178 @@
+"""
+Printable labels of equipment: QR code with the name under it,
+composed into A4 sheets.
+
+Usage: python -m api.labels [--format pdf|png] [--output dir] [id ...]
+"""
+import argparse
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from os import makedirs, path
+
+import qrcode
+from PIL import Image, ImageDraw, ImageFont
+
+from db.models import Equipment
+from .equipment import get_payload
+from .qr_store import QRStore
+
+LABELS_DIR = './images/labels/'
+LABELS_MAX_BYTES = 64 * 1024 * 1024
+# bump to render all labels again after changes of the layout
+LABEL_VERSION = 1
+
+# A4 at 300 dpi
+PAGE_SIZE = (2480, 3508)
+PAGE_MARGIN = 90
+COLUMNS, ROWS = 4, 6
+CELL_SIZE = ((PAGE_SIZE[0] - 2 * PAGE_MARGIN) // COLUMNS,
+             (PAGE_SIZE[1] - 2 * PAGE_MARGIN) // ROWS)
+LABEL_PADDING = 20
+TEXT_HEIGHT = 60
+FONT = 'DejaVuSans.ttf'
+FONT_SIZE = 36
+
+
+def get_label_items(ids: list = None) -> list:
+    """
+    Get (payload, name) of the equipment with the ids or of all equipment
+    """
+    query = Equipment.select(Equipment.id, Equipment.name, Equipment.control).order_by(Equipment.id)
+    if ids:
+        query = query.where(Equipment.id.in_(ids))
+    return [(get_payload(id, control), name) for id, name, control in query.tuples()]
+
+
+# rendered labels, least recently used are removed over the limit
+store = QRStore(LABELS_DIR, LABELS_MAX_BYTES)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_label_data(payload: str, name: str) -> str:
+    """
+    Labels are stored by hash of their content, so a label
+    is rendered again only if its payload or name changed
+    """
+    return f'{LABEL_VERSION}\n{payload}\n{name}'
+
+
+def get_executor(workers: int = None) -> ProcessPoolExecutor:
+    """
+    Worker processes are started on the first request of labels
+    and kept for the next ones
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(workers)
+        return _executor
+
+
+def load_font(size: int = FONT_SIZE):
+    try:
+        return ImageFont.truetype(FONT, size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def fit_text(draw: ImageDraw.ImageDraw, text: str, font, width: int) -> str:
+    while len(text) > 1 and draw.textbbox((0, 0), text, font=font)[2] > width:
+        text = text[:-2] + '…'
+    return text
+
+
+def render_label(payload: str, name: str, filename: str) -> str:
+    """
+    Render label of one cell of the sheet, runs in worker processes
+    """
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_H, border=2)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    side = min(CELL_SIZE[0], CELL_SIZE[1] - TEXT_HEIGHT) - 2 * LABEL_PADDING
+    code = qr.make_image().convert('L').resize((side, side), Image.NEAREST)
+
+    label = Image.new('L', CELL_SIZE, 255)
+    label.paste(code, ((CELL_SIZE[0] - side) // 2, LABEL_PADDING))
+    draw = ImageDraw.Draw(label)
+    font = load_font()
+    text = fit_text(draw, name, font, CELL_SIZE[0] - 2 * LABEL_PADDING)
+    width = draw.textbbox((0, 0), text, font=font)[2]
+    draw.text(((CELL_SIZE[0] - width) // 2, LABEL_PADDING + side), text, fill=0, font=font)
+    label.save(filename)
+    return filename
+
+
+def render_labels(items: list, workers: int = None) -> list:
+    """
+    Render labels of (payload, name) items in parallel, labels
+    rendered before are reused. Return paths of labels in order of items
+    """
+    makedirs(store.directory, exist_ok=True)
+    paths = []
+    jobs = {}
+    for payload, name in items:
+        data = get_label_data(payload, name)
+        file = store.find(data)
+        if file is None:
+            file = store.file_of(data)
+            jobs[file] = (payload, name, file)
+        paths.append(file)
+    if jobs:
+        list(get_executor(workers).map(render_label, *zip(*jobs.values()), chunksize=8))
+    # labels of this request are not evicted before they are placed on sheets
+    store.add(list(jobs), keep=paths)
+    logging.info(f'[LABELS] Rendered {len(jobs)} of {len(items)} labels, {store}')
+    return paths
+
+
+def compose_sheets(labels: list):
+    """
+    Place labels on A4 sheets row by row, sheets are made one at a time
+    """
+    per_sheet = COLUMNS * ROWS
+    for start in range(0, len(labels), per_sheet):
+        sheet = Image.new('L', PAGE_SIZE, 255)
+        for i, file in enumerate(labels[start:start + per_sheet]):
+            row, column = divmod(i, COLUMNS)
+            with Image.open(file) as label:
+                sheet.paste(label, (PAGE_MARGIN + column * CELL_SIZE[0],
+                                    PAGE_MARGIN + row * CELL_SIZE[1]))
+        yield sheet
+
+
+def create_label_sheets(output: str, ids: list = None, file_format: str = 'pdf',
+                        workers: int = None) -> list:
+    """
+    Render labels of the equipment into the output directory, one PDF
+    file or one PNG file per sheet. Return paths of the files
+    """
+    makedirs(output, exist_ok=True)
+    files = []
+    # every sheet is written before the next one is made, a sheet takes ~9MB
+    for number, sheet in enumerate(compose_sheets(render_labels(get_label_items(ids), workers)), start=1):
+        if file_format == 'pdf':
+            files = [path.join(output, 'labels.pdf')]
+            sheet.save(files[0], append=number > 1, resolution=300)
+        else:
+            files.append(path.join(output, f'labels_{number}.png'))
+            sheet.save(files[-1], dpi=(300, 300))
+    return files
+
+
+if __name__ == '__main__':
+    import config
+    from .payload import set_secret
+
+    logging.basicConfig(level=logging.INFO)
+    set_secret(getattr(config, 'QR_SECRET', ''))
+    parser = argparse.ArgumentParser(description='Create printable sheets of QR labels')
+    parser.add_argument('ids', nargs='*', type=int, help='ids of equipment, all equipment by default')
+    parser.add_argument('--format', choices=('pdf', 'png'), default='pdf')
+    parser.add_argument('--output', default='./images/sheets/')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    for file in create_label_sheets(args.output, args.ids, args.format, args.workers):
+        print(file)
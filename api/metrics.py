@@ -0,0 +1,268 @@
+"""
+Counters, gauges and histograms in the Prometheus text format.
+Updating a metric takes a lock and a few additions, so instrumentation
+stays on in production. Metrics can be updated from any thread
+"""
+import bisect
+import math
+import threading
+import time
+from functools import wraps
+
+# seconds, from fast database lookups to slow photo decoding
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+
+class Registry:
+    """
+    All metrics of the process, rendered together for /metrics
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric {metric.name} is already registered')
+            self._metrics[metric.name] = metric
+
+    def get(self, name: str):
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for suffix, labels, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels.items())
+    return f'{{{pairs}}}'
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Metric with values for every combination of labels. Values of
+    metrics with a function are read from it when metrics are rendered:
+    a number, or a dict of numbers by label values if there are labels
+    """
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (),
+                 function=None, registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labels)
+        self._function = function
+        self._children = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def labels(self, *values):
+        """
+        Get value of the metric with these label values
+        """
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} has labels {self.labelnames}, got {values}')
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _values(self) -> dict:
+        if self._function is None:
+            return {values: child.get() for values, child in list(self._children.items())}
+        value = self._function()
+        if not self.labelnames:
+            return {(): value}
+        return {tuple(str(v) for v in (values if isinstance(values, tuple) else (values,))): number
+                for values, number in value.items()}
+
+    def samples(self):
+        for values, value in self._values().items():
+            yield '', dict(zip(self.labelnames, values)), value
+
+
+class Value:
+    __slots__ = ('_value', '_lock')
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value: float):
+        self._value = value
+
+    def get(self) -> float:
+        return self._value
+
+
+class Counter(Metric):
+    """
+    Number of events since start of the bot, it only grows
+    """
+    type = 'counter'
+
+    def _new_child(self) -> Value:
+        return Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    """
+    Current value which goes up and down, like a queue length
+    """
+    type = 'gauge'
+
+    def _new_child(self) -> Value:
+        return Value()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+
+class Timer:
+    """
+    Observe time spent in the with block, exceptions included
+    """
+    __slots__ = ('_histogram', '_start')
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._start)
+
+
+class HistogramValue:
+    __slots__ = ('_bounds', '_counts', '_sum', '_lock')
+
+    def __init__(self, bounds: tuple):
+        self._bounds = bounds
+        # the last bucket is +Inf
+        self._counts = [0] * (len(bounds) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    def time(self) -> Timer:
+        return Timer(self)
+
+    def get(self) -> tuple:
+        """
+        Get cumulative counts of buckets and the sum of values
+        """
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative, count = [], 0
+        for bucket in counts:
+            count += bucket
+            cumulative.append(count)
+        return cumulative, total
+
+
+class Histogram(Metric):
+    """
+    Distribution of values, mostly durations in seconds, by buckets
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        self._bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labels, registry=registry)
+
+    def _new_child(self) -> HistogramValue:
+        return HistogramValue(self._bounds)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self) -> Timer:
+        return Timer(self.labels())
+
+    def samples(self):
+        for values, (cumulative, total) in self._values().items():
+            labels = dict(zip(self.labelnames, values))
+            for bound, count in zip(self._bounds + (math.inf,), cumulative):
+                yield '_bucket', {**labels, 'le': format_value(float(bound))}, count
+            yield '_sum', labels, total
+            yield '_count', labels, cumulative[-1]
+
+
+# database functions are timed where they run, on the loop or in a pool thread
+api_call_seconds = Histogram('api_call_seconds', 'Duration of api functions', ['function'])
+# set while a timed function runs in the thread
+_timing = threading.local()
+
+
+def timed(func):
+    """
+    Time every call of the api function. Calls from other timed
+    functions are counted only in the outer one, so sums add up
+    """
+    histogram = api_call_seconds.labels(f'{func.__module__}.{func.__name__}')
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(_timing, 'active', False):
+            return func(*args, **kwargs)
+        _timing.active = True
+        try:
+            with histogram.time():
+                return func(*args, **kwargs)
+        finally:
+            _timing.active = False
+
+    return wrapper
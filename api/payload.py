@@ -0,0 +1,74 @@
+"""
+Data of equipment QR codes.
+
+Signed payloads look like 'V1:<id>:<tag>', the tag is truncated
+HMAC-SHA256 of 'V1:<id>:<control>' in base32. The control value is
+random for every item, so a label of deleted equipment does not match
+an item which gets its id later. Only uppercase letters, digits and ':'
+are used, they fit alphanumeric mode of QR codes. Legacy payloads
+'<id> <control>' carry the control value itself.
+"""
+import base64
+import hashlib
+import hmac
+import re
+
+VERSION = 'V1'
+TAG_BYTES = 10
+
+SIGNED = re.compile(r'V(\d+):(\d+):([A-Z2-7]+)')
+LEGACY = re.compile(r'(\d+) (\S+)')
+
+_secret = b''
+
+
+def set_secret(secret: str):
+    """
+    Key of signatures, payloads are not signed while it is empty
+    """
+    global _secret
+    _secret = secret.encode() if secret else b''
+
+
+def is_enabled() -> bool:
+    return bool(_secret)
+
+
+def _tag(id: int, control: str, version: str = VERSION) -> str:
+    digest = hmac.new(_secret, f'{version}:{id}:{control}'.encode(), hashlib.sha256).digest()
+    return base64.b32encode(digest[:TAG_BYTES]).decode()
+
+
+def sign(id: int, control: str) -> str:
+    return f'{VERSION}:{id}:{_tag(id, control)}'
+
+
+def is_signed(data: str) -> bool:
+    return SIGNED.fullmatch(data) is not None
+
+
+def verify(data: str, control: str) -> bool:
+    """
+    Check signature of the signed payload with control value
+    of the equipment from the database
+    """
+    match = SIGNED.fullmatch(data)
+    if match is None or not _secret or f'V{match[1]}' != VERSION:
+        return False
+    return hmac.compare_digest(match[3], _tag(int(match[2]), control))
+
+
+def get_equipment_id(data: str):
+    """
+    Get id of equipment from payload of any format, None if data
+    is not a payload
+    """
+    match = SIGNED.fullmatch(data) or LEGACY.fullmatch(data)
+    if match is None:
+        return None
+    return int(match[2] if match.re is SIGNED else match[1])
+
+
+def get_legacy_control(data: str):
+    match = LEGACY.fullmatch(data)
+    return match[2] if match else None
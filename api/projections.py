@@ -0,0 +1,94 @@
+from db.models import User, Category, Equipment, History, Transfer
+
+# every user foreign key gets its own alias to be joined in one query
+Holder = User.alias('holder')
+Owner = User.alias('owner')
+Source = User.alias('source')
+Destination = User.alias('destination')
+
+USER_COLUMNS = ('id', 'name', 'username', 'role')
+
+
+def user_columns(model, prefix: str) -> list:
+    return [getattr(model, name).alias(f'{prefix}__{name}') for name in USER_COLUMNS]
+
+
+def equipment_columns(prefix: str = '') -> list:
+    """
+    Columns of equipment with holder, owner and category,
+    names are paths in the result dict separated by '__'
+    """
+    return [
+        Equipment.id.alias(f'{prefix}id'),
+        Equipment.name.alias(f'{prefix}name'),
+        *user_columns(Holder, f'{prefix}holder'),
+        *user_columns(Owner, f'{prefix}owner'),
+        Category.id.alias(f'{prefix}category__id'),
+        Category.name.alias(f'{prefix}category__name'),
+        Equipment.description.alias(f'{prefix}description'),
+        Equipment.control.alias(f'{prefix}control'),
+    ]
+
+
+def join_equipment_relations(query):
+    return (query
+            .join(Holder, on=(Equipment.holder == Holder.id))
+            .switch(Equipment).join(Owner, on=(Equipment.owner == Owner.id))
+            .switch(Equipment).join(Category, on=(Equipment.category == Category.id)))
+
+
+def select_equipment():
+    return join_equipment_relations(Equipment.select(*equipment_columns()))
+
+
+def select_history():
+    query = (History
+             .select(History.id, *user_columns(Source, 'source'),
+                     *user_columns(Destination, 'destination'),
+                     *equipment_columns('equipment__'), History.date)
+             .join(Source, on=(History.source == Source.id))
+             .switch(History).join(Destination, on=(History.destination == Destination.id))
+             .switch(History).join(Equipment, on=(History.equipment == Equipment.id)))
+    return join_equipment_relations(query)
+
+
+def select_transfers():
+    query = (Transfer
+             .select(Transfer.id, *user_columns(Source, 'source'),
+                     *user_columns(Destination, 'destination'),
+                     *equipment_columns('equipment__'))
+             .join(Source, on=(Transfer.source == Source.id))
+             .switch(Transfer).join(Destination, on=(Transfer.destination == Destination.id))
+             .switch(Transfer).join(Equipment, on=(Transfer.equipment == Equipment.id)))
+    return join_equipment_relations(query)
+
+
+def nest(row: dict) -> dict:
+    """
+    Turn flat row like {'equipment__holder__id': 1} into nested
+    dict like {'equipment': {'holder': {'id': 1}}}, the same as
+    model_to_dict returns
+    """
+    result = {}
+    for key, value in row.items():
+        *path, name = key.split('__')
+        target = result
+        for part in path:
+            target = target.setdefault(part, {})
+        target[name] = value
+    return result
+
+
+def to_dicts(query) -> list:
+    """
+    Execute the query and return rows as nested dicts
+    """
+    return [nest(row) for row in query.dicts()]
+
+
+def to_dict(query):
+    """
+    Execute the query and return the first row as nested dict or None
+    """
+    rows = to_dicts(query.limit(1))
+    return rows[0] if rows else None
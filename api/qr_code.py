@@ -1,5 +1,6 @@
 import qrcode
 import cv2 as cv
+import numpy as np
 from io import BytesIO
 from os import remove
 
@@ -8,18 +9,66 @@ class QRCodeDoesNotExist(Exception):
     ...
 
 
-def get_qr_code_data(file: str) -> str:
-    img = cv.imread(file)
-    # Convert image to black&white
-    gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
-    gray_image = cv.bitwise_not(gray)
+def read_image(source) -> np.ndarray:
+    """
+    Read grayscale image from the file path or from bytes, BytesIO
+    or memoryview with encoded image without copying the buffer
+    """
+    if isinstance(source, str):
+        img = cv.imread(source, cv.IMREAD_GRAYSCALE)
+    else:
+        if isinstance(source, BytesIO):
+            source = source.getbuffer()
+        img = cv.imdecode(np.frombuffer(source, dtype=np.uint8), cv.IMREAD_GRAYSCALE)
+    if img is None:
+        raise TypeError("File is invalid")
+    return img
+
+
+# longest side of the image for the downscaled tier
+DOWNSCALED_SIZE = 800
+
+
+def detect(image: np.ndarray) -> str:
+    """
+    Detect and decode QR code, return empty string if it's not recognized
+    """
+    detector = cv.QRCodeDetector()
+    try:
+        data, points, _ = detector.detectAndDecode(image)
+    except cv.error:
+        return ""
+    return data if points is not None else ""
+
+
+def decode_as_is(gray: np.ndarray) -> str:
+    return detect(gray)
+
+
+def decode_downscaled(gray: np.ndarray) -> str:
+    scale = DOWNSCALED_SIZE / max(gray.shape)
+    if scale < 1:
+        gray = cv.resize(gray, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+    return detect(gray)
 
+
+def preprocess(gray: np.ndarray) -> np.ndarray:
+    """
+    Blur, binarize and morph close the image to find QR code contours
+    """
+    gray_image = cv.bitwise_not(gray)
     blur = cv.GaussianBlur(gray_image, (9, 9), 0)
     thresh = cv.threshold(blur, 0, 255, cv.THRESH_BINARY_INV + cv.THRESH_OTSU)[1]
     # Morph close
     kernel = cv.getStructuringElement(cv.MORPH_RECT, (5, 5))
-    close = cv.morphologyEx(thresh, cv.MORPH_CLOSE, kernel, iterations=2)
-    # Find contours and filter for QR code
+    return cv.morphologyEx(thresh, cv.MORPH_CLOSE, kernel, iterations=2)
+
+
+def find_qr_code_areas(close: np.ndarray) -> list:
+    """
+    Find bounding rectangles of square contours which can be QR codes
+    """
+    areas = []
     contours = cv.findContours(close, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
     contours = contours[0] if len(contours) == 2 else contours[1]
     for cnt in contours:
@@ -28,21 +77,153 @@ def get_qr_code_data(file: str) -> str:
         x, y, w, h = cv.boundingRect(approx)
         area = cv.contourArea(cnt)
         ar = w / float(h)
-        # Crop image
         if len(approx) == 4 and area > 10000 and (ar > 0.85 and ar < 1.3):
-            cv.rectangle(close, (x, y), (x + w, y + h), (36, 255, 12), 3)
-            ROI = close[y : y + h, x : x + w]
+            areas.append((x, y, w, h))
+    return areas
+
+
+def decode_morph(gray: np.ndarray) -> str:
+    close = preprocess(gray)
+    for x, y, w, h in find_qr_code_areas(close):
+        # Crop image
+        data = detect(gray[y : y + h, x : x + w]) or detect(close[y : y + h, x : x + w])
+        if data:
+            return data
+    return ""
+
+
+# decoding strategies from the cheapest to the most expensive one
+TIERS = {
+    "as_is": decode_as_is,
+    "downscaled": decode_downscaled,
+    "morph": decode_morph,
+}
+
+
+def decode_qr_code(file, tiers: tuple = tuple(TIERS)) -> tuple:
+    """
+    Try decoding strategies one by one and stop at the first success.
+    Return QR code data and name of the tier that read it
+    """
+    gray = read_image(file)
+    for tier in tiers:
+        data = TIERS[tier](gray)
+        if data:
+            return data, tier
+    return "", None
+
 
+def get_qr_code_data(file, tiers: tuple = tuple(TIERS)) -> str:
+    """
+    Read QR code data from the photo, file can be a path or encoded image bytes
+    """
+    data, _ = decode_qr_code(file, tiers)
+    if not data:
+        raise QRCodeDoesNotExist("QR Code does not exist or hasn't been recognized")
+    return data
+
+
+def perceptual_hash(file, size: int = 16) -> str:
+    """
+    Difference hash of the photo, the same photo resent or
+    recompressed by Telegram gets the same hash
+    """
+    gray = cv.resize(read_image(file), (size + 1, size), interpolation=cv.INTER_AREA)
+    return np.packbits(gray[:, 1:] > gray[:, :-1]).tobytes().hex()
+
+
+def detect_multi(image: np.ndarray) -> list:
+    """
+    Detect and decode all QR codes on the image
+    """
     detector = cv.QRCodeDetector()
     try:
-        data, points, _ = detector.detectAndDecode(ROI)
+        found, data, _, _ = detector.detectAndDecodeMulti(image)
     except cv.error:
-        raise TypeError("File is invalid")
-    if points is None:
-        raise QRCodeDoesNotExist("QR Code does not exist or hasn't been recognized")
+        return []
+    return [value for value in data if value] if found else []
+
+
+def decode_multi_as_is(gray: np.ndarray) -> list:
+    return detect_multi(gray)
+
+
+def decode_multi_downscaled(gray: np.ndarray) -> list:
+    scale = DOWNSCALED_SIZE / max(gray.shape)
+    if scale < 1:
+        gray = cv.resize(gray, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+    return detect_multi(gray)
+
+
+def decode_multi_morph(gray: np.ndarray) -> list:
+    """
+    Codes which weren't found on the whole photo are searched
+    in every QR code like contour
+    """
+    result = detect_multi(gray)
+    if result:
+        return result
+    return [detect(gray[y : y + h, x : x + w]) for x, y, w, h in find_qr_code_areas(preprocess(gray))]
+
+
+# the same tiers for photos with several QR codes
+MULTI_TIERS = {
+    "as_is": decode_multi_as_is,
+    "downscaled": decode_multi_downscaled,
+    "morph": decode_multi_morph,
+}
+
+
+def decode_qr_codes(file, tiers: tuple = tuple(MULTI_TIERS)) -> tuple:
+    """
+    Read all QR codes with decoding strategies one by one and stop at
+    the first one which finds any. Return list of QR code data and name
+    of the tier that read them
+    """
+    gray = read_image(file)
+    for tier in tiers:
+        # remove empty results and duplicates keeping the order
+        data = [data for data in dict.fromkeys(MULTI_TIERS[tier](gray)) if data]
+        if data:
+            return data, tier
+    return [], None
+
+
+def get_qr_codes_data(file, tiers: tuple = tuple(MULTI_TIERS)) -> list:
+    """
+    Read data of all QR codes from the photo, file can be a path or
+    encoded image bytes
+    """
+    data, _ = decode_qr_codes(file, tiers)
     return data
 
 
+class TierStats:
+    """
+    Count how often each decoding tier is tried and how often it succeeds
+    """
+
+    def __init__(self):
+        self.attempts = dict.fromkeys(TIERS, 0)
+        self.hits = dict.fromkeys(TIERS, 0)
+
+    def record(self, tiers: tuple, hit: str = None):
+        for tier in tiers:
+            self.attempts[tier] += 1
+            if tier == hit:
+                self.hits[tier] += 1
+                break
+
+    def hit_rate(self, tier: str) -> float:
+        return self.hits[tier] / self.attempts[tier] if self.attempts[tier] else 0.0
+
+    def __str__(self):
+        return ", ".join(
+            f"{tier}: {self.hits[tier]}/{self.attempts[tier]} ({self.hit_rate(tier):.0%})"
+            for tier in TIERS
+        )
+
+
 def new_qr_code(
     data_,
     filename,
@@ -53,6 +234,7 @@ def new_qr_code(
     fg_color="black",
     bg_color="white",
     space="RGB",
+    directory="./images/qr_codes/",
 ) -> str:
     qr = qrcode.QRCode(
         version=ver, error_correction=err_cor, box_size=size, border=border
@@ -60,7 +242,7 @@ def new_qr_code(
     qr.add_data(data_)
     qr.make(fit=True)
     img = qr.make_image(fill_color=fg_color, back_color=bg_color).convert(space)
-    img.save(f"./images/qr_codes/{filename}")
+    img.save(f"{directory}{filename}")
     return filename
 
 
@@ -0,0 +1,145 @@
+"""
+QR code images stored by hash of their data. Images are rendered on
+the first request, least recently used files are removed when the
+directory grows over the limit. Images rendered by other processes,
+like labels, are added to a store after rendering. Telegram file_id
+of uploaded images is kept in the database, so they are sent again
+without files.
+"""
+import hashlib
+import logging
+import threading
+from os import listdir, makedirs, path, remove, stat, utime
+
+from db.models import QRCodeFile
+from .qr_code import new_qr_code
+from .metrics import timed
+
+QR_CODES_DIR = './images/qr_codes/'
+BOX_SIZE = 10
+
+
+def get_key(data: str) -> str:
+    return hashlib.sha256(data.encode()).hexdigest()[:32]
+
+
+@timed
+def get_file_id(data: str):
+    row = QRCodeFile.get_or_none(QRCodeFile.key == get_key(data))
+    return row.file_id if row else None
+
+
+@timed
+def set_file_id(data: str, file_id: str):
+    QRCodeFile.replace(key=get_key(data), file_id=file_id).execute()
+
+
+@timed
+def forget_file_id(data: str):
+    QRCodeFile.delete().where(QRCodeFile.key == get_key(data)).execute()
+
+
+class QRStore:
+    """
+    Directory of rendered QR codes bounded by size in bytes
+    """
+
+    def __init__(self, directory: str = QR_CODES_DIR, max_bytes: int = 64 * 1024 * 1024):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+        self.hits = 0
+        self.rendered = 0
+        self.evicted = 0
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    @property
+    def size(self) -> int:
+        """
+        Size of images in bytes, known after the first rendered image
+        """
+        return self._size or 0
+
+    def _files(self) -> list:
+        files = []
+        for name in listdir(self._directory):
+            file = path.join(self._directory, name)
+            info = stat(file)
+            files.append((info.st_mtime, info.st_size, file))
+        return files
+
+    def file_of(self, data: str) -> str:
+        """
+        Path of the image of the data, the file may not exist
+        """
+        return path.join(self._directory, f'{get_key(data)}.png')
+
+    def _touch(self, file: str) -> bool:
+        if not path.exists(file):
+            return False
+        # modification time orders files for eviction
+        utime(file)
+        self.hits += 1
+        return True
+
+    def _add(self, files: list, keep: set):
+        self.rendered += len(files)
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._files())
+        else:
+            self._size += sum(stat(file).st_size for file in files)
+        self._evict(keep)
+
+    def get_path(self, data: str) -> str:
+        """
+        Get path of the image with QR code of the data, render it if needed
+        """
+        file = self.file_of(data)
+        with self._lock:
+            if self._touch(file):
+                return file
+            makedirs(self._directory, exist_ok=True)
+            new_qr_code(data, path.basename(file), size=BOX_SIZE, directory=self._directory)
+            self._add([file], {file})
+        return file
+
+    def find(self, data: str):
+        """
+        Get path of the stored image of the data, None if it isn't stored
+        """
+        file = self.file_of(data)
+        with self._lock:
+            return file if self._touch(file) else None
+
+    def add(self, files: list, keep: list = ()):
+        """
+        Count images which were rendered into the directory by other
+        processes. They and files in keep are not evicted
+        """
+        with self._lock:
+            makedirs(self._directory, exist_ok=True)
+            self._add(files, set(files) | set(keep))
+
+    def _evict(self, keep: set):
+        if self._size <= self._max_bytes:
+            return
+        for _, size, file in sorted(self._files()):
+            if self._size <= self._max_bytes:
+                break
+            if file in keep:
+                continue
+            try:
+                remove(file)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+            self.evicted += 1
+        logging.info(f'[QR STORE] Evicted images, {self}')
+
+    def __str__(self):
+        return (f'{self.size} bytes, {self.hits} hits, '
+                f'{self.rendered} rendered, {self.evicted} evicted')
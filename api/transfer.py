@@ -1,8 +1,13 @@
-from db.models import Transfer, User, Equipment
-from api import history
+from db.models import db, Transfer, User, Equipment
+from api import history, checkout, user
 from .exceptions import *
+from .metrics import Counter, timed
+from .projections import select_transfers, to_dict, to_dicts
 
+transfers_total = Counter('transfers_total', 'Transfers of equipment by action', ['action'])
 
+
+@timed
 def create_transfer(equipment_id: int, source_id: int, destination_id: int):
     try:
         source = User.get(id=source_id)
@@ -16,35 +21,96 @@ def create_transfer(equipment_id: int, source_id: int, destination_id: int):
         Transfer.create(equipment=Equipment.get(id=equipment_id), source=source, destination=destination)
     except Equipment.DoesNotExist:
         raise EquipmentDoesNotExist(f'Equipment with id {equipment_id} does not exist')
+    transfers_total.labels('created').inc()
 
 
-def get_transfer(id: int) -> dict:
+@timed
+def create_transfers(equipment_ids: list, destination_id: int):
+    """
+    Create transfers of several equipment items from their holders
+    to one user in a single transaction
+    """
     try:
-        return Transfer.get(id=id).get_as_dict()
-    except Transfer.DoesNotExist:
+        destination = User.get(id=destination_id)
+    except User.DoesNotExist:
+        raise UserDoesNotExist(f'User with id {destination_id} does not exist')
+    holders = {eq.id: eq.holder_id for eq in Equipment.select(Equipment.id, Equipment.holder).where(Equipment.id.in_(equipment_ids))}
+    for id in equipment_ids:
+        if id not in holders:
+            raise EquipmentDoesNotExist(f'Equipment with id {id} does not exist')
+    with db.atomic('IMMEDIATE'):
+        Transfer.insert_many(
+            [{'equipment': id, 'source': holders[id], 'destination': destination.id} for id in equipment_ids]
+        ).execute()
+    transfers_total.labels('created').inc(len(equipment_ids))
+
+
+@timed
+def get_transfer(id: int) -> dict:
+    t = to_dict(select_transfers().where(Transfer.id == id))
+    if t is None:
         raise TransferDoesNotExist(f'Transfer with id {id} does not exist')
+    return t
 
 
+@timed
 def get_active_transfers(user_id: int) -> list:
-    try:
-        return [t.get_as_dict() for t in Transfer.select().where(Transfer.destination == User.get(id=user_id))]
-    except User.DoesNotExist:
+    if not User.select().where(User.id == user_id).exists():
         raise UserDoesNotExist(f'User with id {user_id} does not exist')
+    return to_dicts(select_transfers().where(Transfer.destination == user_id))
 
 
+@timed
 def verify_transfer(id: int) -> bool:
-    try:
-        t = Transfer.get(id=id)
-    except Transfer.DoesNotExist:
-        raise TransferDoesNotExist(f'Transfer with id {id} does not exist')
-    history.add_row(equipment_id=t.equipment.id, source_id=t.source.id, destination_id=t.destination.id)
-    eq = Equipment.get(id=t.equipment.id)
-    eq.holder = t.destination
-    eq.save()
-    t.delete_instance()
-    return True
+    return verify_transfers([id]) == 1
 
 
+@timed
+def verify_transfers(ids: list) -> int:
+    """
+    Move several transfers into history and change holders of their
+    equipment in one transaction, return number of verified transfers
+    """
+    with db.atomic('IMMEDIATE'):
+        rows = list(Transfer
+                    .select(Transfer.equipment, Transfer.source, Transfer.destination)
+                    .where(Transfer.id.in_(ids))
+                    .tuples())
+        if len(rows) != len(set(ids)):
+            raise TransferDoesNotExist(f'Some of transfers with ids {ids} do not exist')
+        date = history.add_rows(rows)
+        checkout.set_holders(rows, date)
+        destinations = {}
+        for equipment_id, _, destination_id in rows:
+            destinations.setdefault(destination_id, []).append(equipment_id)
+        for destination_id, equipment_ids in destinations.items():
+            Equipment.update(holder=destination_id).where(Equipment.id.in_(equipment_ids)).execute()
+        Transfer.delete().where(Transfer.id.in_(ids)).execute()
+    user.invalidate_profiles(*{u for _, source, destination in rows for u in (source, destination)})
+    transfers_total.labels('verified').inc(len(rows))
+    return len(rows)
+
+
+@timed
+def return_all(user_id: int) -> int:
+    """
+    Return all equipment of the user to the storehouse in one
+    transaction, return number of returned items
+    """
+    with db.atomic('IMMEDIATE'):
+        equipment_ids = [eq.id for eq in Equipment.select(Equipment.id).where(Equipment.holder == user_id)]
+        if not equipment_ids:
+            return 0
+        rows = [(equipment_id, user_id, 1) for equipment_id in equipment_ids]
+        date = history.add_rows(rows)
+        checkout.set_holders(rows, date)
+        Equipment.update(holder=1).where(Equipment.id.in_(equipment_ids)).execute()
+    user.invalidate_profiles(user_id, 1)
+    transfers_total.labels('returned').inc(len(equipment_ids))
+    return len(equipment_ids)
+
+
+@timed
 def delete_transfer(id: int):
     try:
         Transfer.delete().where(Transfer.id == id).execute()
@@ -52,17 +118,18 @@ def delete_transfer(id: int):
         raise TransferDoesNotExist(f'Transfer with id {id} does not exist')
 
 
+@timed
+def delete_transfers(ids: list) -> int:
+    deleted = Transfer.delete().where(Transfer.id.in_(ids)).execute()
+    transfers_total.labels('deleted').inc(deleted)
+    return deleted
+
+
+@timed
 def get_transfer_by_equipment_id(id: int) -> dict:
-    try:
-        eq = Equipment.get(id=id)
-    except Equipment.DoesNotExist:
+    if not Equipment.select().where(Equipment.id == id).exists():
         raise EquipmentDoesNotExist(f'Equipment with id {id} does not exist')
-    try:
-        transfer = Transfer.get(equipment=eq)
-    except Transfer.DoesNotExist:
-        raise TransferDoesNotExist(f'Transfer with equipment with id {id} does not exist')
-    try:
-        transfer = Transfer.get(equipment=eq)
-    except Transfer.DoesNotExist:
+    transfer = to_dict(select_transfers().where(Transfer.equipment == id))
+    if transfer is None:
         raise TransferDoesNotExist(f'Transfer with equipment with id {id} does not exist')
-    return transfer.get_as_dict()
+    return transfer
@@ -1,84 +1,150 @@
-from db.models import User, History
+from db.models import User, Equipment
 from .exceptions import *
+from .checkout import get_holder_checkouts
+from .cache import TTLCache
+from .metrics import timed
+
+# users with access to the bot
+VERIFIED_ROLES = ['member', 'admin']
+
+# user rows with has_equipment flag by user id, every function which
+# changes them must call invalidate_profiles
+profiles = TTLCache(maxsize=4096, ttl=30*60)
+# list of admins, cleared together with any profile
+admin_roster = TTLCache(maxsize=1, ttl=30*60)
+
+
+@timed
+def load_profile(id: int) -> dict:
+    """
+    Read profile of the user from the DB and put it into the cache
+    """
+    token = profiles.start_load(id)
+    try:
+        profile = User.select().where(User.id == id).dicts().first()
+        if profile is None:
+            raise UserDoesNotExist(f'User with id {id} does not exist')
+        profile['has_equipment'] = Equipment.select().where(Equipment.holder == id).exists()
+        # not cached if the user was changed while the profile was read
+        profiles.set_loaded(id, profile, token)
+    finally:
+        profiles.end_load(id, token)
+    return profile
+
+
+@timed
+def get_profile(id: int) -> dict:
+    profile = profiles.get(id)
+    return profile if profile is not None else load_profile(id)
+
 
+def invalidate_profiles(*ids: int):
+    for id in ids:
+        profiles.pop(id)
+    admin_roster.clear()
 
+
+@timed
 def create_user(id_: int, name: str, username: str, status: str = 'main_menu', role: str = 'user'):
     User.create(id=id_, name=name, username=username, status=status, role=role)
+    invalidate_profiles(id_)
 
 
+@timed
 def get_user(id: int) -> dict:
-    try:
-        return User.get(id=id).get_as_dict()
-    except User.DoesNotExist:
+    u = User.select().where(User.id == id).dicts().first()
+    if u is None:
         raise UserDoesNotExist(f'User with id {id} does not exist')
+    return u
 
 
+@timed
 def delete_user(id: int):
     try:
         User.delete().where(User.id == id).execute()
     except User.DoesNotExist:
         raise UserDoesNotExist(f'User with id {id} does not exist')
+    invalidate_profiles(id)
 
 
+@timed
 def get_user_by_username(username: str) -> dict:
-    try:
-        return User.get(username=username).get_as_dict()
-    except User.DoesNotExist:
+    u = User.select().where(User.username == username).dicts().first()
+    if u is None:
         raise UserDoesNotExist(f'User with username {username} does not exist')
+    return u
 
 
+@timed
 def is_admin(id: int) -> bool:
-    try:
-        return User.get(id=id).role == 'admin'
-    except User.DoesNotExist:
-        raise UserDoesNotExist(f'User with id {id} does not exist')
+    return get_profile(id)['role'] == 'admin'
 
 
+@timed
 def is_exists(id: int) -> bool:
     try:
-        User.get(id=id)
-    except User.DoesNotExist:
+        get_profile(id)
+    except UserDoesNotExist:
         return False
     return True
 
 
+@timed
 def is_verified(id: int) -> bool:
-    try:
-        return User.get(id=id).role in ['member', 'admin']
-    except User.DoesNotExist:
-        raise UserDoesNotExist(f'User with id {id} does not exist')
+    return get_profile(id)['role'] in VERIFIED_ROLES
 
 
+@timed
 def verify_user(id: int) -> bool:
+    return set_role(id, 'member')
+
+
+@timed
+def set_role(id: int, role: str) -> bool:
     try:
         u = User.get(id=id)
     except User.DoesNotExist:
         raise UserDoesNotExist(f'User with id {id} does not exist')
-    u.role = 'member'
+    u.role = role
     u.save()
+    invalidate_profiles(id)
     return True
 
 
+@timed
 def get_user_equipment(id: int) -> list:
-    res = []
-    try:
-        u = User.get(id=id)
-    except User.DoesNotExist:
+    if not is_exists(id):
         raise UserDoesNotExist(f'User with id {id} does not exist')
-    for eq in u.equipment:
-        pick_date = History.select().where(History.equipment == eq).order_by(History.id.desc()).get().date.date()
-        res.append({'id': eq.id, 'name': eq.name, 'picked': pick_date})
-    return res
+    return [{'id': eq['id'], 'name': eq['name'], 'picked': eq['since'].date()}
+            for eq in get_holder_checkouts(id)]
+
+
+@timed
+def load_admin_list() -> list:
+    """
+    Read admins from the DB and put them into the cache
+    """
+    token = admin_roster.start_load('admins')
+    try:
+        admins = list(User.select().where(User.role == 'admin').dicts())
+        admin_roster.set_loaded('admins', admins, token)
+    finally:
+        admin_roster.end_load('admins', token)
+    return admins
 
 
+@timed
 def get_admin_list() -> list:
-    return [admin.get_as_dict() for admin in User.select().where(User.role == 'admin')]
+    admins = admin_roster.get('admins')
+    return admins if admins is not None else load_admin_list()
 
 
+@timed
 def change_username(user_id: int, new_username: str):
     try:
         user = User.get(id=user_id)
     except User.DoesNotExist:
-        raise UserDoesNotExist(f'User with id {id} does not exist')
+        raise UserDoesNotExist(f'User with id {user_id} does not exist')
     user.username = new_username
     user.save()
+    invalidate_profiles(user_id)
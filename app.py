@@ -1,9 +1,34 @@
 from aiogram import executor
+import config
 import timer
-from interface.init_bot import dp
+from interface.init_bot import dp, outbox
 from interface.handlers import start_menu
+from interface.metrics import instrument_dispatcher, start_metrics_server
+from interface.webhook import derive_secret, start_webhook
 from daemon import main as daemon
+from db.migrations import migrate_database
+
+
+async def on_startup(_):
+    # metrics are served only if METRICS_PORT is set, by default to this host only
+    if getattr(config, 'METRICS_PORT', None):
+        await start_metrics_server(getattr(config, 'METRICS_HOST', '127.0.0.1'), config.METRICS_PORT)
+
 
 if __name__ == '__main__':
+    migrate_database()
+    instrument_dispatcher(dp)
     timer_instance = timer.Timer(2*24*60*60, daemon, True, False)
-    executor.start_polling(dp, skip_updates=True)
+    if getattr(config, 'WEBHOOK_URL', None):
+        # Telegram sends updates to WEBHOOK_URL, which must lead to WEBHOOK_PATH of the server,
+        # the secret is appended to both. Without WEBHOOK_SECRET it is made from the token
+        start_webhook(dp, url=config.WEBHOOK_URL,
+                      path=getattr(config, 'WEBHOOK_PATH', '/webhook'),
+                      secret=getattr(config, 'WEBHOOK_SECRET', None) or derive_secret(config.TOKEN),
+                      host=getattr(config, 'WEBHOOK_HOST', '0.0.0.0'),
+                      port=getattr(config, 'WEBHOOK_PORT', 8080),
+                      outbox=outbox,
+                      drain_timeout=getattr(config, 'WEBHOOK_DRAIN_TIMEOUT', 30),
+                      on_startup=on_startup)
+    else:
+        executor.start_polling(dp, skip_updates=True, on_startup=on_startup)
@@ -0,0 +1,190 @@
+import asyncio
+import io
+import itertools
+import sys
+import time
+import types
+from os import path
+
+
+def make_photo_corpus(directory: str, count: int = 5, size: tuple = (1280, 960)) -> list:
+    """
+    Create JPEG photos with a QR code on a noisy background,
+    similar to the ones users send to the bot
+    """
+    import cv2 as cv
+    import numpy as np
+    import qrcode
+
+    rng = np.random.default_rng(0)
+    files = []
+    for i in range(count):
+        qr = qrcode.QRCode(version=2, box_size=12, border=4)
+        qr.add_data(f'{i + 1} abcdef')
+        qr.make(fit=True)
+        code = np.array(qr.make_image().convert('L'), dtype=np.uint8)
+        photo = rng.integers(90, 170, (size[1], size[0]), dtype=np.uint8)
+        y = int(rng.integers(0, size[1] - code.shape[0]))
+        x = int(rng.integers(0, size[0] - code.shape[1]))
+        photo[y:y + code.shape[0], x:x + code.shape[1]] = code
+        filename = path.join(directory, f'photo_{i}.jpg')
+        cv.imwrite(filename, cv.cvtColor(photo, cv.COLOR_GRAY2BGR))
+        files.append(filename)
+    return files
+
+
+def use_test_config(**settings):
+    """
+    Give settings to the bot modules, a config without real token
+    is made if there is no config.py. Call it before interface
+    modules are imported
+    """
+    try:
+        import config
+    except ImportError:
+        config = types.ModuleType('config')
+        config.TOKEN = '123456789:' + 'A' * 35
+        sys.modules['config'] = config
+    for name, value in settings.items():
+        setattr(config, name, value)
+    return config
+
+
+class BotStub:
+    """
+    Answer requests of the bot without network and record them.
+    Downloaded files are taken from the files dict by file_id
+    """
+
+    def __init__(self, bot, files: dict = None):
+        self.calls = []
+        self._files = files or {}
+        self._message_ids = itertools.count(1)
+        bot.request = self.request
+        bot.download_file_by_id = self.download_file_by_id
+
+    async def request(self, method: str, data: dict = None, files: dict = None, **kwargs):
+        self.calls.append(method)
+        data = data or {}
+        if method not in ('sendMessage', 'sendDocument', 'editMessageText'):
+            return True
+        message = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                   'chat': {'id': int(data.get('chat_id', 0)), 'type': 'private'},
+                   'text': data.get('text', '')}
+        if method == 'sendDocument':
+            file_id = f'document{message["message_id"]}'
+            message['document'] = {'file_id': file_id, 'file_unique_id': file_id}
+        return message
+
+    async def download_file_by_id(self, file_id: str, *args, **kwargs):
+        return io.BytesIO(self._files.get(file_id, b''))
+
+
+def use_database(path: str = ':memory:'):
+    """
+    Point models to a separate database and apply migrations to it
+    """
+    from api import user
+    from db.models import db
+    from db.migrations import migrate_database
+
+    db.init(path)
+    # cached rows of the previous database would be served as they are
+    user.profiles.clear()
+    user.admin_roster.clear()
+    migrate_database()
+    return db
+
+
+def seed_database(users: int = 20, equipment: int = 100, history: int = 1000):
+    """
+    Fill the database with users, equipment and random history of
+    transfers. Storehouse and categories are created by migrations
+    """
+    import random
+    from datetime import datetime, timedelta
+    from db.models import db, User, Equipment, History
+
+    random.seed(0)
+    now = datetime.now()
+    with db.atomic():
+        User.insert_many(
+            [{'id': 100 + i, 'name': f'user {i}', 'username': f'user{i}',
+              'role': 'admin' if i < 2 else 'member'} for i in range(users)]
+        ).execute()
+        Equipment.insert_many(
+            [{'name': f'equipment {i}', 'holder': 1, 'owner': 1, 'category': i % 8 + 1,
+              'description': '', 'control': 'abcdef'} for i in range(equipment)]
+        ).execute()
+        rows = []
+        for i in range(history):
+            rows.append({'equipment': random.randint(1, equipment),
+                         'source': random.choice([1, 100 + random.randrange(users)]),
+                         'destination': random.choice([1, 100 + random.randrange(users)]),
+                         'date': now - timedelta(minutes=history - i)})
+            if len(rows) == 1000:
+                History.insert_many(rows).execute()
+                rows = []
+        if rows:
+            History.insert_many(rows).execute()
+
+
+class QueryCounter:
+    """
+    Count SQL queries executed inside the with block
+    """
+
+    def __init__(self, db):
+        self._db = db
+        self.count = 0
+
+    def __enter__(self):
+        execute_sql = self._db.execute_sql
+
+        def counting_execute_sql(*args, **kwargs):
+            self.count += 1
+            return execute_sql(*args, **kwargs)
+
+        self._db.execute_sql = counting_execute_sql
+        return self
+
+    def __exit__(self, *exc):
+        del self._db.execute_sql
+
+
+class LoopLagProbe:
+    """
+    Measure how late the event loop wakes up a sleeping coroutine
+    while the with block is running
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self._interval = interval
+        self._task = None
+        self.lags = []
+
+    async def _probe(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self._interval)
+            self.lags.append(time.perf_counter() - start - self._interval)
+
+    async def __aenter__(self):
+        self._task = asyncio.ensure_future(self._probe())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._task.cancel()
+
+    def __str__(self):
+        return f'loop lag {percentiles(self.lags)}'
+
+
+def percentiles(values: list, points: tuple = (50, 95, 99)) -> str:
+    """
+    Format percentiles of durations in milliseconds
+    """
+    values = sorted(values) or [0]
+    return ', '.join(
+        f'p{point} {values[min(len(values) - 1, len(values) * point // 100)] * 1000:.1f}ms'
+        for point in points) + f', max {values[-1] * 1000:.1f}ms'
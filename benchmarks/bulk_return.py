@@ -0,0 +1,49 @@
+"""
+Compare returning equipment one transfer at a time with return_all.
+
+Usage: python -m benchmarks.bulk_return [items]
+"""
+import sys
+import tempfile
+import time
+from os import path
+
+from api import transfer
+from benchmarks import QueryCounter, seed_database, use_database
+from db.models import Equipment
+
+USER_ID = 100
+
+
+def take(db, items: int):
+    ids = [eq.id for eq in Equipment.select(Equipment.id).limit(items)]
+    transfer.create_transfers(ids, USER_ID)
+    transfer.verify_transfers([t['id'] for t in transfer.get_active_transfers(USER_ID)])
+
+
+def return_one_by_one(items: int):
+    # the old return_equipment flow: a transfer and a transaction per item
+    for eq in Equipment.select(Equipment.id).where(Equipment.holder == USER_ID):
+        transfer.create_transfer(eq.id, USER_ID, 1)
+        transfer.verify_transfer(transfer.get_transfer_by_equipment_id(eq.id)['id'])
+
+
+def return_in_bulk(items: int):
+    transfer.return_all(USER_ID)
+
+
+def main(items: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = use_database(path.join(tmp, 'db.sqlite3'))
+        seed_database(equipment=items, history=0)
+        for func in (return_one_by_one, return_in_bulk):
+            take(db, items)
+            with QueryCounter(db) as counter:
+                start = time.perf_counter()
+                func(items)
+                elapsed = time.perf_counter() - start
+            print(f'{func.__name__:>17}: {elapsed * 1000:.1f}ms, {counter.count} queries for {items} items')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
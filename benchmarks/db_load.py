@@ -0,0 +1,64 @@
+"""
+Load test of concurrent handlers reading and writing the database,
+run on the event loop and in the database thread pool.
+
+Usage: python -m benchmarks.db_load [users] [rounds]
+"""
+import asyncio
+import sys
+import tempfile
+import time
+from os import path
+
+from api import equipment, history, transfer
+from benchmarks import LoopLagProbe, percentiles, seed_database, use_database
+from db.executor import run_in_db
+
+
+async def run_inline(func, *args):
+    return func(*args)
+
+
+async def handler_session(run, user_id: int, items: list, rounds: int, latencies: list):
+    """
+    Take equipment, look at the menu and history, return everything
+    """
+    for _ in range(rounds):
+        for call in [
+            (transfer.create_transfers, items, user_id),
+            (lambda: transfer.verify_transfers(
+                [t['id'] for t in transfer.get_active_transfers(user_id)]),),
+            (equipment.get_equipment_by_holder, user_id),
+            (history.get_last_actions, 20),
+            (transfer.return_all, user_id),
+        ]:
+            start = time.perf_counter()
+            await run(*call)
+            latencies.append(time.perf_counter() - start)
+
+
+async def measure(name: str, run, users: int, rounds: int):
+    latencies = []
+    async with LoopLagProbe() as probe:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            handler_session(run, 100 + i, [i * 3 + 1, i * 3 + 2, i * 3 + 3], rounds, latencies)
+            for i in range(users)])
+        elapsed = time.perf_counter() - start
+    print(f'{name:>8}: {len(latencies) / elapsed:.0f} calls/s, '
+          f'call latency {percentiles(latencies)}\n{"":>10}{probe}')
+
+
+def main(users: int, rounds: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        # a file, not :memory:, so that every thread sees the same database
+        use_database(path.join(tmp, 'db.sqlite3'))
+        seed_database(users=users, equipment=users * 3, history=10000)
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(measure('inline', run_inline, users, rounds))
+        loop.run_until_complete(measure('threads', run_in_db, users, rounds))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 10)
@@ -0,0 +1,59 @@
+"""
+Event loop latency while N photos are decoded at the same time.
+
+Usage: python -m benchmarks.decode_latency [uploads] [photos_dir]
+"""
+import asyncio
+import sys
+import tempfile
+import time
+from os import listdir, path
+
+from api import qr_code
+from api.decoder import DecodePool
+from benchmarks import LoopLagProbe, make_photo_corpus
+
+
+async def decode_inline(file: str):
+    try:
+        qr_code.get_qr_code_data(file)
+    except Exception:
+        pass
+
+
+async def decode_in_pool(pool: DecodePool, file: str):
+    try:
+        await pool.run(qr_code.get_qr_code_data, file)
+    except Exception:
+        pass
+
+
+async def measure(name: str, jobs):
+    async with LoopLagProbe() as probe:
+        start = time.perf_counter()
+        await asyncio.gather(*jobs)
+        elapsed = time.perf_counter() - start
+    print(f'{name:>8}: total {elapsed:.2f}s, {probe}')
+
+
+async def main(uploads: int, photos_dir: str):
+    files = [path.join(photos_dir, name) for name in sorted(listdir(photos_dir))]
+    files = [files[i % len(files)] for i in range(uploads)]
+
+    await measure('inline', (decode_inline(file) for file in files))
+
+    pool = DecodePool(workers=2, max_queue=uploads, timeout=60)
+    # warm up the workers so process start is not counted
+    await decode_in_pool(pool, files[0])
+    await measure('pool', (decode_in_pool(pool, file) for file in files))
+    pool.shutdown()
+
+
+if __name__ == '__main__':
+    uploads = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    if len(sys.argv) > 2:
+        asyncio.get_event_loop().run_until_complete(main(uploads, sys.argv[2]))
+    else:
+        with tempfile.TemporaryDirectory() as photos_dir:
+            make_photo_corpus(photos_dir)
+            asyncio.get_event_loop().run_until_complete(main(uploads, photos_dir))
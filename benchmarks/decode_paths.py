@@ -0,0 +1,58 @@
+"""
+Compare decoding through a temporary JPEG file with in-memory decoding.
+
+Usage: python -m benchmarks.decode_paths [rounds] [photos_dir]
+"""
+import sys
+import tempfile
+import time
+from io import BytesIO
+from os import listdir, path
+
+from api import qr_code
+from benchmarks import make_photo_corpus
+
+
+def through_file(photo: BytesIO, directory: str, name: str):
+    # the old read_qr_code flow: save, read from disk, delete
+    filename = path.join(directory, f'{name}.jpg')
+    with open(filename, 'wb') as out:
+        out.write(photo.getbuffer())
+    try:
+        qr_code.get_qr_code_data(filename)
+    except Exception:
+        pass
+    qr_code.delete_file(filename)
+
+
+def in_memory(photo: BytesIO, *_):
+    try:
+        qr_code.get_qr_code_data(photo)
+    except Exception:
+        pass
+
+
+def main(rounds: int, photos_dir: str):
+    photos = []
+    for name in sorted(listdir(photos_dir)):
+        with open(path.join(photos_dir, name), 'rb') as file:
+            photos.append(BytesIO(file.read()))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for func in (through_file, in_memory):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for i, photo in enumerate(photos):
+                    func(photo, tmp, str(i))
+            elapsed = time.perf_counter() - start
+            print(f'{func.__name__:>12}: {elapsed / (rounds * len(photos)) * 1000:.2f}ms per photo')
+
+
+if __name__ == '__main__':
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    if len(sys.argv) > 2:
+        main(rounds, sys.argv[2])
+    else:
+        with tempfile.TemporaryDirectory() as photos_dir:
+            make_photo_corpus(photos_dir)
+            main(rounds, photos_dir)
@@ -0,0 +1,95 @@
+"""
+Replay whole conversations of many users through the dispatcher:
+start, categories, taking equipment by photo, confirmation by admin
+and return. Requests to Telegram are answered by a stub and photos
+are decoded by the real decoder pool.
+
+Reports latency of handlers by kind of update, updates per second
+and database queries per update.
+
+Usage: python -m benchmarks.dispatcher_load [users]
+"""
+import asyncio
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from os import path
+
+from benchmarks import (BotStub, QueryCounter, make_photo_corpus, percentiles,
+                        seed_database, use_database, use_test_config)
+from benchmarks import updates
+
+ADMIN_ID = 100
+
+
+def conversation(user_id: int, file_id: str) -> list:
+    """
+    Updates of one user in the order they are sent, as (kind, update)
+    """
+    return [
+        ('start', updates.message(user_id, '/start')),
+        ('categories', updates.callback(user_id, 'categories')),
+        ('take_equipment', updates.callback(user_id, 'take_equipment')),
+        ('photo', updates.photo(user_id, file_id)),
+        ('ok', updates.message(user_id, '/ok')),
+        ('conf_success', updates.callback(ADMIN_ID, f'conf_success {user_id}')),
+        ('return_eq', updates.callback(user_id, 'return_eq')),
+    ]
+
+
+async def main(users: int, photos: dict):
+    from aiogram import Bot, Dispatcher, types
+    from db.models import History, db
+    from interface.init_bot import dp, bot, outbox, decode_pool
+    from interface.handlers import start_menu
+
+    stub = BotStub(bot, photos)
+    Dispatcher.set_current(dp)
+    Bot.set_current(bot)
+    latencies = defaultdict(list)
+
+    async def replay(user_id: int, file_id: str):
+        for kind, update in conversation(user_id, file_id):
+            update = types.Update(**update)
+            start = time.perf_counter()
+            # own task per update like in polling, filters keep the state in context
+            await asyncio.ensure_future(dp.updates_handler.notify(update))
+            latencies[kind].append(time.perf_counter() - start)
+
+    # seeded users from 102 are members, the first two are admins
+    members = range(ADMIN_ID + 2, ADMIN_ID + 2 + users)
+    history = History.select().count()
+    with QueryCounter(db) as counter:
+        start = time.perf_counter()
+        await asyncio.gather(*[replay(user_id, f'photo{i + 1}')
+                               for i, user_id in enumerate(members)])
+        elapsed = time.perf_counter() - start
+    count = sum(len(values) for values in latencies.values())
+    for kind, values in latencies.items():
+        print(f'{kind:>15}: {percentiles(values)}')
+    print(f'{count} updates in {elapsed:.2f}s ({count / elapsed:.0f}/s), '
+          f'{counter.count / count:.1f} queries per update, {len(stub.calls)} bot requests')
+    # confirmed transfers and returns add records to the history
+    print(f'{History.select().count() - history} history records added, '
+          f'{2 * users} expected')
+    await outbox.close()
+    decode_pool.shutdown()
+
+
+if __name__ == '__main__':
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    # without limits of Telegram the outbox doesn't slow handlers down,
+    # all photos fit into the decoder queue
+    use_test_config(NOTIFY_RATE=10**6, NOTIFY_CHAT_RATE=10**6, NOTIFY_CHAT_BURST=10**6,
+                    QR_QUEUE_SIZE=users, FSM_STORAGE='sqlite')
+    with tempfile.TemporaryDirectory() as tmp:
+        use_database(path.join(tmp, 'db.sqlite3'))
+        seed_database(users=users + 2, equipment=max(users, 100), history=10000)
+        # photo of user i has QR code of equipment i
+        files = make_photo_corpus(tmp, count=users)
+        photos = {}
+        for i, file in enumerate(files):
+            with open(file, 'rb') as photo:
+                photos[f'photo{i + 1}'] = photo.read()
+        asyncio.get_event_loop().run_until_complete(main(users, photos))
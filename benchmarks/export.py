@@ -0,0 +1,44 @@
+"""
+Time of the history export and its peak memory for a month and for
+the whole history, peak must not grow with number of rows.
+
+Usage: python -m benchmarks.export [history_rows] [csv|xlsx]
+"""
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from os import path
+
+from api.export import export_history
+from benchmarks import seed_database, use_database
+
+
+def measure(name: str, file: str, file_format: str, start: date = None):
+    tracemalloc.start()
+    started = time.perf_counter()
+    count = export_history(file, start=start, file_format=file_format)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{name:>6}: {count} rows in {elapsed:.1f}s ({count / elapsed:.0f} rows/s), '
+          f'{path.getsize(file) / 2**20:.1f}MB file, peak memory {peak / 2**20:.2f}MB')
+
+
+def main(rows: int, file_format: str):
+    with tempfile.TemporaryDirectory() as tmp:
+        use_database(path.join(tmp, 'db.sqlite3'))
+        started = time.perf_counter()
+        seed_database(users=200, equipment=2000, history=rows)
+        print(f'seeded {rows} history rows in {time.perf_counter() - started:.1f}s')
+
+        file = path.join(tmp, f'history.{file_format}')
+        # seeded history is one row per minute until now
+        measure('month', file, file_format, start=date.today() - timedelta(days=30))
+        measure('all', file, file_format)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+         sys.argv[2] if len(sys.argv) > 2 else 'csv')
@@ -0,0 +1,66 @@
+"""
+Latency of state reads and updates and memory per conversation
+for the memory and the database FSM storages.
+
+Usage: python -m benchmarks.fsm_storage [sessions]
+"""
+import asyncio
+import sys
+import tempfile
+import time
+import tracemalloc
+from os import path
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+
+from benchmarks import percentiles, use_database
+from interface.storage import SQLiteStorage
+
+
+async def take_equipment(storage, chat: int):
+    """
+    The same calls as taking of two items and waiting for admins
+    """
+    await storage.set_state(chat=chat, user=chat, state='Take_Equipment:scan_qr_code')
+    await storage.update_data(chat=chat, user=chat, data={'user_items': [], 'equipment_names': []})
+    for i in range(2):
+        data = await storage.get_data(chat=chat, user=chat)
+        await storage.update_data(chat=chat, user=chat, data={
+            'user_items': data['user_items'] + [f'V1:{chat + i}:ABCDEFGHIJKLMNOP'],
+            'equipment_names': data['equipment_names'] + [f'equipment {chat + i}'],
+            'user_id': chat})
+    await storage.set_state(chat=chat, user=chat, state='Take_Equipment:wait_for_admins')
+    await storage.update_data(chat=chat, user=chat, data={'admin_messages': [(100, 1000 + chat), (101, 2000 + chat)]})
+
+
+async def measure(name: str, storage, sessions: int):
+    gets, updates = [], []
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for chat in range(sessions):
+        await take_equipment(storage, chat)
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    for chat in range(sessions):
+        start = time.perf_counter()
+        data = await storage.get_data(chat=chat, user=chat)
+        gets.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        await storage.update_data(chat=chat, user=chat, data={'user_id': data['user_id']})
+        updates.append(time.perf_counter() - start)
+    print(f'{name:>12}: {memory / sessions:.0f} bytes per session\n'
+          f'{"get":>12}: {percentiles(gets)}\n{"update":>12}: {percentiles(updates)}')
+
+
+async def main(sessions: int):
+    await measure('memory', MemoryStorage(), sessions)
+    with tempfile.TemporaryDirectory() as tmp:
+        use_database(path.join(tmp, 'db.sqlite3'))
+        await measure('sqlite', SQLiteStorage(), sessions)
+        # after restart every first read goes to the database
+        await measure('sqlite cold', SQLiteStorage(cache_size=1), sessions)
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000))
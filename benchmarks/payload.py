@@ -0,0 +1,47 @@
+"""
+Throughput of QR code validation for signed, legacy, deleted, forged
+and garbage payloads and number of queries made for them.
+
+Usage: python -m benchmarks.payload [scans]
+"""
+import logging
+import random
+import sys
+import tempfile
+import time
+from os import path
+
+from api import payload
+from benchmarks import QueryCounter, seed_database, use_database
+from interface.parse_data import validate_qr_code
+
+
+def measure(name: str, db, codes: list):
+    with QueryCounter(db) as counter:
+        start = time.perf_counter()
+        valid = sum(validate_qr_code(code) for code in codes)
+        elapsed = time.perf_counter() - start
+    print(f'{name:>8}: {len(codes) / elapsed:>9.0f} scans/s, '
+          f'{counter.count / len(codes):.1f} queries per scan, {valid} valid')
+
+
+def main(scans: int):
+    random.seed(0)
+    # rejected scans are logged as errors, keep the output readable
+    logging.disable(logging.ERROR)
+    payload.set_secret('benchmark')
+    with tempfile.TemporaryDirectory() as tmp:
+        db = use_database(path.join(tmp, 'db.sqlite3'))
+        seed_database(equipment=1000, history=0)
+        ids = [random.randint(1, 1000) for _ in range(scans)]
+        # seeded equipment has control sum 'abcdef'
+        measure('signed', db, [payload.sign(id, 'abcdef') for id in ids])
+        measure('legacy', db, [f'{id} abcdef' for id in ids])
+        # labels of equipment which was deleted
+        measure('deleted', db, [payload.sign(id + 1000, 'abcdef') for id in ids])
+        measure('forged', db, [f'V1:{id}:AAAAAAAAAAAAAAAA' for id in ids])
+        measure('garbage', db, [f'https://example.com/{id}' for id in ids])
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
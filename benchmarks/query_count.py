@@ -0,0 +1,47 @@
+"""
+Check that list functions of the api run the same number of queries
+no matter how many rows they return.
+
+Usage: python -m benchmarks.query_count
+"""
+from api import category, equipment, history, transfer, user
+from benchmarks import QueryCounter, seed_database, use_database
+
+CALLS = {
+    'get_last_actions': lambda: history.get_last_actions(20),
+    'get_user_history': lambda: history.get_user_history(100),
+    'get_equipment_history': lambda: history.get_equipment_history(1),
+    'get_history_by_period': lambda: history.get_history_by_period(1, 1, 2000, 1, 1, 2100),
+    'get_category_equipment': lambda: category.get_category_equipment(1),
+    'get_equipment_by_holder': lambda: equipment.get_equipment_by_holder(1),
+    'get_active_transfers': lambda: transfer.get_active_transfers(100),
+    'get_admin_list': lambda: user.get_admin_list(),
+}
+
+
+def count_queries(db) -> dict:
+    result = {}
+    for name, call in CALLS.items():
+        with QueryCounter(db) as counter:
+            rows = call()
+        result[name] = (counter.count, len(rows))
+    return result
+
+
+def main():
+    small = count_queries(_prepare(equipment=10, history=50))
+    large = count_queries(_prepare(equipment=500, history=5000))
+    for name in CALLS:
+        print(f'{name:>24}: {small[name][0]} queries for {small[name][1]} rows, '
+              f'{large[name][0]} queries for {large[name][1]} rows')
+        assert small[name][0] == large[name][0], f'{name} runs a query per row'
+
+
+def _prepare(**sizes):
+    db = use_database()
+    seed_database(**sizes)
+    return db
+
+
+if __name__ == '__main__':
+    main()
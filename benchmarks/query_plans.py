@@ -0,0 +1,62 @@
+"""
+Check with EXPLAIN QUERY PLAN that hot queries use indexes
+instead of scanning whole tables.
+
+Usage: python -m benchmarks.query_plans
+"""
+from datetime import datetime
+
+from api.history import history_page_query
+from benchmarks import seed_database, use_database
+from db.models import User, Equipment, History
+
+
+def hot_queries() -> dict:
+    return {
+        'history by date': History.select().where(History.date > datetime.now()),
+        'equipment history': (History.select().where(History.equipment == 1)
+                              .order_by(History.date.desc(), History.id.desc()).limit(21)),
+        'last actions': History.select().order_by(History.date.desc(), History.id.desc()).limit(21),
+        'period history': (History.select().where(History.date >= datetime(2020, 1, 1))
+                           .order_by(History.date.desc(), History.id.desc()).limit(21)),
+        'history by source': History.select().where(History.source == 1),
+        # the same queries as pages of user's history in the bot
+        'user history': history_page_query(user_id=100),
+        'user history older': history_page_query(user_id=100, before=(datetime.now(), 10**9)),
+        'user history newer': history_page_query(user_id=100, after=(datetime(2020, 1, 1), 0)),
+        'category page': (Equipment.select().where((Equipment.category == 1) & (Equipment.id > 10))
+                          .order_by(Equipment.id).limit(11)),
+        'category page back': (Equipment.select().where((Equipment.category == 1) & (Equipment.id < 90))
+                               .order_by(Equipment.id.desc()).limit(11)),
+        'equipment by name': Equipment.select().where(Equipment.name == 'equipment 1'),
+        'user by username': User.select().where(User.username == 'user1'),
+        'admin list': User.select().where(User.role == 'admin'),
+    }
+
+
+def uses_index(plan: list) -> bool:
+    # every step must search by index, a plain SCAN reads the whole table
+    # and a temp b-tree sorts all matching rows before LIMIT. Subqueries
+    # with LIMIT are materialized, a scan of them reads only their rows
+    materialized = {f'SCAN {detail.split()[-1]}' for detail in plan if detail.startswith('MATERIALIZE')}
+    return all(('SCAN' not in detail or 'USING' in detail or detail in materialized)
+               and 'TEMP B-TREE' not in detail
+               for detail in plan)
+
+
+def main():
+    db = use_database()
+    seed_database()
+    db.execute_sql('ANALYZE')
+    failed = []
+    for name, query in hot_queries().items():
+        sql, params = query.sql()
+        plan = [row[-1] for row in db.execute_sql(f'EXPLAIN QUERY PLAN {sql}', params)]
+        print(f'{name:>18}: {"; ".join(plan)}')
+        if not uses_index(plan):
+            failed.append(name)
+    assert not failed, f'Queries without index: {", ".join(failed)}'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Latency of start menu lookups done one after another on the event loop,
+awaited together from the database thread pool and read from the
+profile cache, which loads missing profiles on the loop.
+
+Usage: python -m benchmarks.start_menu [concurrent_starts]
+"""
+import asyncio
+import sys
+import tempfile
+import time
+from os import path
+
+from api import aio, equipment, user
+from benchmarks import LoopLagProbe, percentiles, seed_database, use_database
+from db.models import Equipment
+
+
+async def sequential(user_id: int):
+    # the old create_start_menu_buttons
+    return equipment.get_equipment_by_holder(user_id), user.is_admin(user_id)
+
+
+async def gathered(user_id: int):
+    return await asyncio.gather(aio.get_equipment_by_holder(user_id), aio.is_admin(user_id))
+
+
+async def cached(user_id: int):
+    return await aio.get_profile(user_id)
+
+
+async def measure(func, starts: int):
+    latencies = []
+
+    async def start_menu(user_id: int):
+        start = time.perf_counter()
+        await func(user_id)
+        latencies.append(time.perf_counter() - start)
+
+    async with LoopLagProbe() as probe:
+        await asyncio.gather(*[start_menu(100 + i % 20) for i in range(starts)])
+    print(f'{func.__name__:>10}: start menu {percentiles(latencies)}\n{"":>12}{probe}')
+
+
+def main(starts: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        use_database(path.join(tmp, 'db.sqlite3'))
+        seed_database(users=20, equipment=2000, history=10000)
+        # give every user some equipment to list
+        equipment_ids = list(range(1, 2001))
+        for i in range(20):
+            Equipment.update(holder=100 + i).where(Equipment.id.in_(equipment_ids[i::20])).execute()
+        loop = asyncio.get_event_loop()
+        for func in (sequential, gathered, cached):
+            # every user misses the cache once
+            user.profiles.clear()
+            loop.run_until_complete(measure(func, starts))
+        print(f'profile cache: {user.profiles}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,42 @@
+"""
+Time the search of unreturned equipment on a large history table,
+rebuilding of checkouts and the search of overdue checkouts.
+
+Usage: python -m benchmarks.unreturned [history_rows]
+"""
+import sys
+import tempfile
+import time
+from os import path
+
+from api.checkout import get_overdue_checkouts, rebuild_checkouts
+from api.history import get_unreturned_equipment
+from benchmarks import seed_database, use_database
+
+
+def main(rows: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        use_database(path.join(tmp, 'db.sqlite3'))
+        start = time.perf_counter()
+        seed_database(users=200, equipment=2000, history=rows)
+        print(f'seeded {rows} history rows in {time.perf_counter() - start:.1f}s')
+
+        start = time.perf_counter()
+        users = get_unreturned_equipment()
+        elapsed = time.perf_counter() - start
+        items = sum(len(data['equipment']) for data in users.values())
+        print(f'found {items} unreturned items of {len(users)} users in {elapsed * 1000:.1f}ms')
+
+        start = time.perf_counter()
+        rebuild_checkouts()
+        print(f'rebuilt checkouts in {(time.perf_counter() - start) * 1000:.1f}ms')
+
+        start = time.perf_counter()
+        users = get_overdue_checkouts()
+        elapsed = time.perf_counter() - start
+        items = sum(len(data['equipment']) for data in users.values())
+        print(f'found {items} overdue items of {len(users)} users in {elapsed * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
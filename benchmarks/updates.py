@@ -0,0 +1,57 @@
+"""
+Synthetic Telegram updates like the ones users send to the bot
+"""
+import itertools
+import time
+
+_update_ids = itertools.count(1)
+
+
+def user(user_id: int) -> dict:
+    # seeded users have username 'user<i>' and ids from 100
+    return {'id': user_id, 'is_bot': False, 'first_name': f'user {user_id - 100}',
+            'username': f'user{user_id - 100}'}
+
+
+def chat(user_id: int) -> dict:
+    return {'id': user_id, 'type': 'private', 'username': f'user{user_id - 100}',
+            'first_name': f'user {user_id - 100}'}
+
+
+def message(user_id: int, text: str = None, **fields) -> dict:
+    update_id = next(_update_ids)
+    data = {'message_id': update_id, 'date': int(time.time()), 'from': user(user_id),
+            'chat': chat(user_id), **fields}
+    if text is not None:
+        data['text'] = text
+        if text.startswith('/'):
+            data['entities'] = [{'type': 'bot_command', 'offset': 0,
+                                 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': data}
+
+
+def callback(user_id: int, data: str) -> dict:
+    update_id = next(_update_ids)
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'from': user(user_id), 'chat_instance': str(user_id), 'data': data,
+        'message': {'message_id': update_id, 'date': int(time.time()),
+                    'chat': chat(user_id), 'text': 'menu'}}}
+
+
+def photo(user_id: int, file_id: str, width: int = 1280, height: int = 960) -> dict:
+    sizes = [{'file_id': f'{file_id}_{size}', 'file_unique_id': f'{file_id}_{size}',
+              'width': width * size // 1280, 'height': height * size // 1280}
+             for size in (90, 320, 800)]
+    sizes.append({'file_id': file_id, 'file_unique_id': file_id, 'width': width, 'height': height})
+    return message(user_id, photo=sizes)
+
+
+def browsing(users: list) -> list:
+    """
+    Every user opens the menu, categories, a category and history
+    """
+    updates = []
+    for user_id in users:
+        updates += [message(user_id, '/start'), callback(user_id, 'categories'),
+                    callback(user_id, 'category cameras'), callback(user_id, 'get_history')]
+    return updates
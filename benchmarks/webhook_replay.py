@@ -0,0 +1,76 @@
+"""
+Post updates to the webhook server as fast as possible and measure
+how fast they are accepted and handled. Requests of the bot are
+answered by a stub, so nothing goes to Telegram.
+
+Updates are synthetic or read from a file with one JSON update per line.
+
+Usage: python -m benchmarks.webhook_replay [users] [updates.jsonl]
+"""
+import asyncio
+import json
+import sys
+import tempfile
+import time
+from os import path
+
+from benchmarks import BotStub, percentiles, seed_database, use_database, use_test_config
+
+CONCURRENCY = 64
+
+
+async def post_all(session, url: str, updates: list) -> list:
+    latencies = []
+    queue = list(reversed(updates))
+
+    async def worker():
+        while queue:
+            update = queue.pop()
+            start = time.perf_counter()
+            async with session.post(url, json=update) as response:
+                assert response.status == 200, response.status
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[worker() for _ in range(CONCURRENCY)])
+    return latencies
+
+
+async def main(updates: list):
+    from aiohttp import ClientSession
+    from aiohttp.test_utils import TestServer
+    from interface.init_bot import dp, bot, outbox
+    from interface.handlers import start_menu
+    from interface.webhook import create_app
+
+    stub = BotStub(bot)
+    app = create_app(dp, '/webhook', 'benchmark', outbox=outbox)
+    handler = app['update_handler']
+    server = TestServer(app)
+    await server.start_server()
+    async with ClientSession() as session:
+        start = time.perf_counter()
+        latencies = await post_all(session, str(server.make_url('/webhook/benchmark')), updates)
+        accepted = time.perf_counter() - start
+        await handler.drain(timeout=600)
+        handled = time.perf_counter() - start
+    print(f'accepted {len(updates)} updates in {accepted:.2f}s '
+          f'({len(updates) / accepted:.0f}/s), ack {percentiles(latencies)}')
+    print(f'handled in {handled:.2f}s ({len(updates) / handled:.0f}/s), {handler}, '
+          f'{len(stub.calls)} bot requests')
+    await server.close()
+
+
+if __name__ == '__main__':
+    # without limits of Telegram the outbox doesn't slow handlers down
+    use_test_config(NOTIFY_RATE=10**6, NOTIFY_CHAT_RATE=10**6, NOTIFY_CHAT_BURST=10**6)
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as tmp:
+        use_database(path.join(tmp, 'db.sqlite3'))
+        seed_database(users=users, equipment=500, history=10000)
+        if len(sys.argv) > 2:
+            with open(sys.argv[2]) as file:
+                recorded = [json.loads(line) for line in file if line.strip()]
+        else:
+            from benchmarks import updates
+            recorded = updates.browsing(range(100, 100 + users))
+        asyncio.get_event_loop().run_until_complete(main(recorded))
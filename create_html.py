@@ -1,14 +1,39 @@
-import xml.dom as dom
-from os import listdir
+from os import makedirs, path
+from shutil import copyfile
 from dominate import document
 from dominate.tags import *
 
-imagesPath = './images/qr_codes/'
-images = listdir(imagesPath)
+import config
+from api import payload
+from api.equipment import get_payload
+from api.qr_store import QRStore
+from db.models import Equipment
+
+# images are named by hash of QR code data, so names are taken from
+# the equipment whose data gives the same hash
+payload.set_secret(getattr(config, 'QR_SECRET', ''))
+store = QRStore(max_bytes=getattr(config, 'QR_STORE_SIZE', 64*1024*1024))
+# the store can remove its files at any time, the page uses copies of them
+imagesPath = './qr_codes_files/'
+makedirs(imagesPath, exist_ok=True)
+
+
+def copy_image(data: str) -> str:
+    file = path.join(imagesPath, path.basename(store.file_of(data)))
+    try:
+        copyfile(store.get_path(data), file)
+    except FileNotFoundError:
+        # removed by the bot right after it was found, rendered again
+        copyfile(store.get_path(data), file)
+    return file
+
 
 with document(title='QRcodes2HTML') as doc:
-    for path in images:
-        tr(img(src=imagesPath+path))
+    for eq in Equipment.select(Equipment.id, Equipment.name, Equipment.control).order_by(Equipment.id):
+        # missing images are rendered
+        with tr():
+            td(img(src=copy_image(get_payload(eq.id, eq.control))))
+            td(eq.name)
 
 with open('qr_codes.html', 'w') as file:
     file.write(doc.render())
@@ -0,0 +1,34 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from api.metrics import Histogram
+
+# sqlite allows one writer at a time, the rest of threads serve readers
+DB_THREADS = 4
+
+executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix='db')
+
+# waiting for a free thread is included
+db_call_seconds = Histogram('db_call_seconds', 'Duration of database functions', ['function'])
+
+
+async def run_in_db(func, *args, **kwargs):
+    """
+    Run blocking database function in the database thread pool
+    so the event loop keeps handling updates
+    """
+    loop = asyncio.get_event_loop()
+    with db_call_seconds.labels(f'{func.__module__}.{func.__name__}').time():
+        return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+
+def in_db_thread(func):
+    """
+    Make awaitable version of blocking database function
+    """
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_db(func, *args, **kwargs)
+
+    return wrapper
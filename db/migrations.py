@@ -0,0 +1,121 @@
+from datetime import datetime
+import logging
+
+from playhouse.migrate import SqliteMigrator, migrate
+
+from db.models import db, User, Category, Equipment, History, Transfer, Checkout, QRCodeFile, FSMState, SchemaVersion
+
+migrator = SqliteMigrator(db)
+
+
+def initial():
+    """
+    Create tables, the storehouse user and categories.
+    Databases created by the old init_db.py already have them
+    """
+    db.create_tables([User, Category, Equipment, History, Transfer])
+    if not User.select().where(User.id == 1).exists():
+        User.create(id=1, name='Штаб', username='Штаб', role='Штаб')
+    if not Category.select().exists():
+        for name in ['cameras', 'light', 'audio', 'lenses', 'tripods', 'battery', 'power', 'broadcast']:
+            Category.create(name=name)
+
+
+def add_lookup_indexes():
+    """
+    Indexes for history by date and by user, equipment by name
+    and users by username and role. History of equipment ordered
+    by id uses index of the equipment_id foreign key, because
+    sqlite indexes contain rowid
+    """
+    migrate(
+        migrator.add_index('history', ('date',)),
+        migrator.add_index('history', ('source_id', 'date')),
+        migrator.add_index('history', ('destination_id', 'date')),
+        migrator.add_index('equipment', ('name',)),
+        migrator.add_index('user', ('username',)),
+        migrator.add_index('user', ('role',)),
+    )
+
+
+def add_checkouts():
+    """
+    Table with current holders of the equipment, filled from history
+    """
+    from api.checkout import rebuild_checkouts
+
+    db.create_tables([Checkout])
+    rebuild_checkouts()
+
+
+def add_history_cursor_index():
+    """
+    Index for history of equipment ordered by (date, id) cursor,
+    cursors of users and of all history use the other date indexes
+    """
+    migrate(
+        migrator.add_index('history', ('equipment_id', 'date')),
+    )
+
+
+def add_qr_code_files():
+    """
+    Table with Telegram file ids of sent QR code images
+    """
+    db.create_tables([QRCodeFile])
+
+
+def add_fsm_states():
+    """
+    Table with conversations of the bot, they survive restarts
+    """
+    db.create_tables([FSMState])
+
+
+def add_user_history_index():
+    """
+    History of a user is merged from the indexes by source and by
+    destination, the destination one covers source_id to skip actions
+    of the user with themselves without reading rows
+    """
+    migrate(
+        migrator.drop_index('history', 'history_destination_id_date'),
+        migrator.add_index('history', ('destination_id', 'date', 'id', 'source_id')),
+    )
+
+
+# migrations are applied in this order, position in the list is the version
+MIGRATIONS = [
+    initial,
+    add_lookup_indexes,
+    add_checkouts,
+    add_history_cursor_index,
+    add_qr_code_files,
+    add_fsm_states,
+    add_user_history_index,
+]
+
+
+def get_version() -> int:
+    if not SchemaVersion.table_exists():
+        return 0
+    row = SchemaVersion.select().order_by(SchemaVersion.version.desc()).first()
+    return row.version if row else 0
+
+
+def migrate_database():
+    """
+    Apply migrations which weren't applied to the database yet
+    """
+    db.create_tables([SchemaVersion])
+    version = get_version()
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        logging.info(f'[MIGRATION] Applying {number}: {migration.__name__}')
+        with db.atomic():
+            migration()
+            SchemaVersion.create(version=number, applied=datetime.now())
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    migrate_database()
@@ -1,8 +1,14 @@
 from peewee import *
 from playhouse.shortcuts import model_to_dict
 
-db = SqliteDatabase('db.sqlite3')
-db.pragma('foreign_keys', 1, permanent=True)
+db = SqliteDatabase('db.sqlite3', pragmas={
+    'journal_mode': 'wal',  # readers don't wait for writers
+    'synchronous': 1,  # NORMAL, safe with WAL and fsyncs only on checkpoints
+    'cache_size': -32 * 1024,  # 32MB of page cache
+    'mmap_size': 128 * 1024 * 1024,
+    'busy_timeout': 5000,  # wait for other writers instead of failing
+    'foreign_keys': 1,
+})
 
 
 class BaseModel(Model):
@@ -50,3 +56,36 @@ class Transfer(BaseModel):
         on_delete='CASCADE')
     equipment = ForeignKeyField(Equipment, backref='transfers', \
         on_delete='CASCADE')
+
+
+# holder of equipment out of the storehouse, since when and from whom the holder has it
+class Checkout(BaseModel):
+    equipment = ForeignKeyField(Equipment, backref='checkout', unique=True, \
+        on_delete='CASCADE')
+    holder = ForeignKeyField(User, backref='checkouts', on_delete='CASCADE')
+    source = ForeignKeyField(User, backref='given_checkouts', \
+        on_delete='CASCADE')
+    since = DateTimeField(index=True)
+
+
+# Telegram file_id of uploaded QR code image by hash of its data
+class QRCodeFile(BaseModel):
+    key = TextField(unique=True)
+    file_id = TextField()
+
+
+# state and data as JSON of the conversation with the user in the chat
+class FSMState(BaseModel):
+    chat = BigIntegerField()
+    user = BigIntegerField()
+    state = TextField(null=True)
+    data = TextField()
+    updated = FloatField(index=True)
+
+    class Meta:
+        primary_key = CompositeKey('chat', 'user')
+
+
+class SchemaVersion(BaseModel):
+    version = IntegerField()
+    applied = DateTimeField()
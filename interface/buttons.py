@@ -1,9 +1,10 @@
+from functools import wraps
+
 from aiogram import types
 
 from interface.init_bot import bot
 from api.category import get_all_categories
-from api.equipment import get_equipment_by_holder
-from api.user import is_admin
+from api import aio
 
 
 def create_inline_buttons(buttons_list: list) -> list:
@@ -26,21 +27,22 @@ def create_inline_markup(
     )
 
 
-def create_start_menu_buttons(user_id: int):
+async def create_start_menu_buttons(user_id: int):
     """
     Create list of start menu buttons with main functionality
     """
+    profile = await aio.get_profile(user_id)
     start_menu_buttons = [
         {"text": "\U0001F4CB Категории", "callback": "categories"},
         {"text": "\U0001F4F1 Взять технику", "callback": "take_equipment"},
         {"text": "\U0001F50D Мониторинг", "callback": "get_history"},
         {"text": "\U0001F9D0 Отсканировать QR код", "callback": "scan_qr_code"},
     ]
-    if get_equipment_by_holder(user_id):
+    if profile["has_equipment"]:
         start_menu_buttons.append(
             {"text": "\U0001F4E5 Вернуть технику", "callback": "return_eq"}
         )
-    if is_admin(user_id):
+    if profile["role"] == "admin":
         start_menu_buttons.append(
             {"text": "\U0001F9B8 Админ панель", "callback": "admin_panel"}
         )
@@ -71,11 +73,27 @@ def create_categories_buttons():
     return create_inline_markup(categories_buttons)
 
 
+def create_page_markup(prev_callback: str = None, next_callback: str = None):
+    """
+    Create Prev/Next buttons of paginated list, None if there
+    is only one page
+    """
+    page_buttons = []
+    if prev_callback is not None:
+        page_buttons.append({"text": "\u2B05 Назад", "callback": prev_callback})
+    if next_callback is not None:
+        page_buttons.append({"text": "Далее \u27A1", "callback": next_callback})
+    if not page_buttons:
+        return None
+    return create_inline_markup(page_buttons, row_width=2)
+
+
 def delete_message(func):
     """
     Delete message that triggered the callback
     """
 
+    @wraps(func)
     async def wrapper(*args):
         if isinstance(args[0], types.CallbackQuery):
             call = args[0]
@@ -1,9 +1,20 @@
+import asyncio
+import logging
+import tempfile
+import time
+from datetime import date, datetime
+from os import path
+
 from aiogram import types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
+from aiogram.utils.exceptions import BadRequest
 
-from interface.init_bot import dp, bot
-from api import equipment, category, user
+from interface.init_bot import dp, bot, outbox, qr_store
+from api import equipment, category, user, export, labels, aio
+from api.exceptions import EquipmentDoesNotExist, ExportFormatIsNotSupported
+from api.payload import get_equipment_id
+from db.executor import run_in_db
 import interface.buttons as buttons
 from interface.handlers.equipment import read_qr_code
 from interface.parse_data import validate_qr_code
@@ -22,8 +33,8 @@ async def delete_user_step_1(call: types.CallbackQuery):
     """
     Start deleting user
     """
-    await bot.send_message(chat_id=call.message.chat.id,
-                           text='Отправьте тэг пользователя или его id.\nЧтобы\
+    await outbox.send(chat_id=call.message.chat.id,
+                      text='Отправьте тэг пользователя или его id.\nЧтобы\
  узнать id пользователя воспользуйтесь\
  @userinfobot')
     await Delete_User.waiting_for_user_id.set()
@@ -48,16 +59,16 @@ async def delete_user_step_2(message: types.Message, state: FSMContext):
         user_data = int(message.text)
 
     if not exception_msg:
-        if user.is_exists(user_data):
-            user.delete_user(user_data)
-            await bot.send_message(chat_id=message.chat.id,
-                                   text='Пользователь был успешно удалён')
+        if await aio.is_exists(user_data):
+            await aio.delete_user(user_data)
+            await outbox.send(chat_id=message.chat.id,
+                              text='Пользователь был успешно удалён')
         else:
             exception_msg = 'Пользователя не существует'
 
     if exception_msg:
-        await bot.send_message(chat_id=message.chat.id,
-                               text=exception_msg)
+        await outbox.send(chat_id=message.chat.id,
+                          text=exception_msg)
     await state.finish()
 
 
@@ -76,7 +87,7 @@ async def add_equipment_step_1(call: types.CallbackQuery):
     """
     Start adding equipment
     """
-    await bot.send_message(chat_id=call.message.chat.id, text='Отправьте\
+    await outbox.send(chat_id=call.message.chat.id, text='Отправьте\
  название техники и тэг или id владельца с новой строки.\
  \nПример:\nAvermedia LGP\n@tag_of_owner\n\nЧтобы узнать id пользователя\
   воспользуйтесь @userinfobot')
@@ -98,32 +109,32 @@ async def add_equipment_step_2(message: types.Message, state: FSMContext):
         try:
             owner_data = user.get_user_by_username(data[1][1:])
         except Exception:
-            await bot.send_message(chat_id=message.chat.id,
-                                   text=f'Пользователь с тэгом {data[1]} не\
+            await outbox.send(chat_id=message.chat.id,
+                              text=f'Пользователь с тэгом {data[1]} не\
  найден. Начните добавление техники заново\
  и попробуйте ввести id пользователя')
     elif data[1] == 'Штаб':
         try:
             owner_data = user.get_user_by_username(data[1])
         except Exception:
-            await bot.send_message(chat_id=message.chat.id,
-                                   text=f'Пользователь с тэгом {data[1]} не\
+            await outbox.send(chat_id=message.chat.id,
+                              text=f'Пользователь с тэгом {data[1]} не\
  найден. Начните добавление техники заново\
  и попробуйте ввести id пользователя')
     else:
         try:
             owner_data = user.get_user(int(data[1]))
         except Exception:
-            await bot.send_message(chat_id=message.chat.id, text='Данного\
+            await outbox.send(chat_id=message.chat.id, text='Данного\
  пользователя нет в базе данных. Его необходимо\
  зарегистрировать, чтобы добавить технику.\nДля возвращения в\
  главное меню напишите /start')
     if owner_data:
         await state.update_data(eq_name=data[0].strip(), owner=owner_data['id'])
-        await bot.send_message(chat_id=message.chat.id,
-                               text='Выберите категорию для техники',
-                               reply_markup=buttons.create_categories_buttons()
-                               )
+        await outbox.send(chat_id=message.chat.id,
+                          text='Выберите категорию для техники',
+                          reply_markup=buttons.create_categories_buttons()
+                          )
         await Add_Equipment.next()
     else:
         await state.finish()
@@ -138,8 +149,8 @@ async def add_equipment_step_3(call: types.CallbackQuery, state: FSMContext):
     category_id = [cat['name'] for cat in category.get_all_categories()].index(
         call.data.split()[1]) + 1
     await state.update_data(category=category_id)
-    await bot.send_message(chat_id=call.message.chat.id,
-                           text='Отправьте описание для техники (до 30 слов)')
+    await outbox.send(chat_id=call.message.chat.id,
+                      text='Отправьте описание для техники (до 30 слов)')
     await Add_Equipment.next()
 
 
@@ -154,14 +165,17 @@ async def add_equipment_step_4(message: types.Message, state: FSMContext):
     eq_data = await state.get_data()
     await state.finish()
     try:
-        equipment.add_equipment(eq_data['category'], eq_data['eq_name'],
-                                eq_data['owner'], eq_data['description'])
-        await bot.send_message(chat_id=message.chat.id,
-                            text='Техника была успешно добавлена.\nДля\
+        equipment_id = await aio.add_equipment(
+            eq_data['category'], eq_data['eq_name'], eq_data['owner'],
+            eq_data['description'])
+        await outbox.send(chat_id=message.chat.id,
+                          text='Техника была успешно добавлена.\nДля\
  возвращения в главное меню напишите /start')
     except Exception:
-        await bot.send_message(chat_id=message.chat.id,
-                               text='Произошла ошибка. Попробуйте ещё раз')
+        await outbox.send(chat_id=message.chat.id,
+                          text='Произошла ошибка. Попробуйте ещё раз')
+    else:
+        await send_qr_code(message.chat.id, equipment_id)
 
 
 class Delete_Equipment(StatesGroup):
@@ -177,8 +191,8 @@ async def delete_equipment_step_1(call: types.CallbackQuery):
     """
     Start deleting the equipment
     """
-    await bot.send_message(chat_id=call.message.chat.id,
-                           text='Отправьте полное название техники или QR код')
+    await outbox.send(chat_id=call.message.chat.id,
+                      text='Отправьте полное название техники или QR код')
     await Delete_Equipment.waiting_for_equipment_info.set()
 
 
@@ -192,13 +206,13 @@ async def delete_eq_by_name(message: types.Message, state: FSMContext):
     try:
         equipment_id = equipment.get_equipment_by_name(message.text)['id']
     except Exception:
-        await bot.send_message(chat_id=message.chat.id,
-                               text=f'Техники с названием "{message.text}"\
+        await outbox.send(chat_id=message.chat.id,
+                          text=f'Техники с названием "{message.text}"\
  не существует')
     else:
-        equipment.delete_equipment(equipment_id)
-        await bot.send_message(chat_id=message.chat.id,
-                               text='Техника была успешно удалена')
+        await aio.delete_equipment(equipment_id)
+        await outbox.send(chat_id=message.chat.id,
+                          text='Техника была успешно удалена')
     await state.finish()
 
 
@@ -210,12 +224,18 @@ async def delete_eq_by_qrcode(message: types.Message, state: FSMContext):
     """
     qr_code_data = await read_qr_code(message)
     if validate_qr_code(qr_code_data):
-        equipment_id = int(qr_code_data.split()[0])
-        equipment.delete_equipment(equipment_id)
-        await bot.send_message(chat_id=message.chat.id,
-                               text='Техника была успешно удалена')
+        equipment_id = get_equipment_id(qr_code_data)
+        try:
+            await aio.delete_equipment(equipment_id)
+        except EquipmentDoesNotExist:
+            # deleted after the code was checked
+            await outbox.send(chat_id=message.chat.id,
+                              text='Данной техники нет в базе данных')
+        else:
+            await outbox.send(chat_id=message.chat.id,
+                              text='Техника была успешно удалена')
     else: 
-        await bot.send_message(
+        await outbox.send(
             chat_id=message.chat.id,
             text='Произошла ошибка в распознавании фото. Попробуйте ещё раз')
     await state.finish()
@@ -235,8 +255,8 @@ async def change_desc_step_1(call: types.CallbackQuery):
     """
     Start changing description of the equipment
     """
-    await bot.send_message(chat_id=call.message.chat.id,
-                           text='Отправьте полное название техники или QR код')
+    await outbox.send(chat_id=call.message.chat.id,
+                      text='Отправьте полное название техники или QR код')
     await Change_Description.waiting_for_equipment_info.set()
 
 
@@ -250,14 +270,14 @@ async def change_desc_by_name(message: types.Message, state: FSMContext):
     try:
         equipment_id = equipment.get_equipment_by_name(message.text)['id']
     except Exception:
-        await bot.send_message(chat_id=message.chat.id,
-                               text=f'Техники с названием "{message.text}"\
+        await outbox.send(chat_id=message.chat.id,
+                          text=f'Техники с названием "{message.text}"\
  не существует')
         await state.finish()
     else:
         await state.update_data(eq_id=equipment_id)
-        await bot.send_message(chat_id=message.chat.id,
-                               text='Отправьте описание техники (до 30 слов)')
+        await outbox.send(chat_id=message.chat.id,
+                          text='Отправьте описание техники (до 30 слов)')
         await Change_Description.next()
 
 
@@ -269,15 +289,15 @@ async def change_desc_by_qrcode(message: types.Message, state: FSMContext):
     """
     qr_code_data = await read_qr_code(message)
     if not validate_qr_code(qr_code_data):
-        await bot.send_message(
+        await outbox.send(
             chat_id=message.chat.id,
             text='Произошла ошибка в распознавании фото. Попробуйте ещё раз')
         await state.finish()
     else:
-        equipment_id = int(qr_code_data.split()[0])
+        equipment_id = get_equipment_id(qr_code_data)
         equipment.get_equipment(equipment_id)
         await state.update_data(eq_id=equipment_id)
-        await bot.send_message(
+        await outbox.send(
             chat_id=message.chat.id,
             text='Отправьте описание техники (до 30 слов)')
         await Change_Description.next()
@@ -292,9 +312,9 @@ async def change_desc_step_3(message: types.Message, state: FSMContext):
     """
     eq_id = await state.get_data()
     eq_id = eq_id['eq_id']
-    equipment.change_equipment_description(eq_id, message.text)
-    await bot.send_message(chat_id=message.chat.id,
-                           text='Описание техники было успешно изменено')
+    await aio.change_equipment_description(eq_id, message.text)
+    await outbox.send(chat_id=message.chat.id,
+                      text='Описание техники было успешно изменено')
     await state.finish()
 
 
@@ -312,8 +332,8 @@ async def change_name_step_1(call: types.CallbackQuery):
     """
     Start changing name of the equipment
     """
-    await bot.send_message(chat_id=call.message.chat.id,
-                           text='Отправьте полное название техники или QR код')
+    await outbox.send(chat_id=call.message.chat.id,
+                      text='Отправьте полное название техники или QR код')
     await Change_Name.waiting_for_equipment_info.set()
 
 
@@ -327,13 +347,13 @@ async def change_name_by_name(message: types.Message, state: FSMContext):
     try:
         equipment_id = equipment.get_equipment_by_name(message.text)['id']
     except Exception:
-        await bot.send_message(chat_id=message.chat.id,
-                               text=f'Техники с названием "{message.text}"\
+        await outbox.send(chat_id=message.chat.id,
+                          text=f'Техники с названием "{message.text}"\
  не существует')
         await state.finish()
     else:
         await state.update_data(eq_id=equipment_id)
-        await bot.send_message(
+        await outbox.send(
             chat_id=message.chat.id,
             text='Отправьте новое название техники (5-6 слов)')
         await Change_Name.next()
@@ -347,15 +367,15 @@ async def change_name_by_qrcode(message: types.Message, state: FSMContext):
     """
     qr_code_data = await read_qr_code(message)
     if not validate_qr_code(qr_code_data):
-        await bot.send_message(
+        await outbox.send(
             chat_id=message.chat.id,
             text='Произошла ошибка в распознавании фото. Попробуйте ещё раз')
         await state.finish()
     else:
-        equipment_id = int(qr_code_data.split()[0])
+        equipment_id = get_equipment_id(qr_code_data)
         equipment.get_equipment(equipment_id)
         await state.update_data(eq_id=equipment_id)
-        await bot.send_message(
+        await outbox.send(
             chat_id=message.chat.id,
             text='Отправьте новое название техники (5-6 слов)')
         await Change_Name.next()
@@ -370,7 +390,111 @@ async def change_name_step_3(message: types.Message, state: FSMContext):
     """
     eq_id = await state.get_data()
     eq_id = eq_id['eq_id']
-    equipment.change_equipment_name(eq_id, message.text)
-    await bot.send_message(chat_id=message.chat.id,
-                           text='Название техники было успешно изменено')
+    await aio.change_equipment_name(eq_id, message.text)
+    await outbox.send(chat_id=message.chat.id,
+                      text='Название техники было успешно изменено')
     await state.finish()
+
+
+@dp.message_handler(commands='export')
+async def export_history(message: types.Message):
+    """
+    Send history as a file: /export [start end] [xlsx], dates are
+    like 01.12.2021, current month is exported without dates
+    """
+    if not await aio.is_admin(message.chat.id):
+        return
+    args = message.get_args().split()
+    file_format = 'csv'
+    if args and args[-1] in export.WRITERS:
+        file_format = args.pop()
+    try:
+        if args:
+            start, end = [datetime.strptime(arg, '%d.%m.%Y').date() for arg in args]
+        else:
+            end = date.today()
+            start = end.replace(day=1)
+    except ValueError:
+        await outbox.send(chat_id=message.chat.id,
+                          text='Введённые даты неправильные. Пример:\n\
+/export 01.12.2021 31.12.2021 csv')
+        return
+
+    name = f'history_{start:%Y%m%d}_{end:%Y%m%d}.{file_format}'
+    with tempfile.TemporaryDirectory() as directory:
+        file = path.join(directory, name)
+        started = time.perf_counter()
+        try:
+            count = await run_in_db(export.export_history, file, start, end, file_format)
+        except ExportFormatIsNotSupported:
+            await outbox.send(chat_id=message.chat.id,
+                              text=f'Экспорт в {file_format} недоступен')
+            return
+        logging.info(f'[EXPORT] {count} rows to {name} in '
+                     f'{time.perf_counter() - started:.2f}s')
+        await bot.send_document(
+            message.chat.id, types.InputFile(file, filename=name),
+            caption=f'История с {start:%d.%m.%Y} по {end:%d.%m.%Y}: {count} записей')
+
+
+@dp.message_handler(commands='labels')
+async def send_label_sheets(message: types.Message):
+    """
+    Send A4 sheets of QR labels: /labels [pdf|png] [id ...],
+    labels of all equipment are sent without ids
+    """
+    if not await aio.is_admin(message.chat.id):
+        return
+    args = message.get_args().split()
+    file_format = 'pdf'
+    if args and args[0] in ('pdf', 'png'):
+        file_format = args.pop(0)
+    if not all(arg.isdigit() for arg in args):
+        await outbox.send(chat_id=message.chat.id,
+                          text='Пример:\n/labels pdf 1 2 3')
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        # rendering uses worker processes, wait for it outside of the loop
+        files = await asyncio.get_event_loop().run_in_executor(
+            None, labels.create_label_sheets, directory, [int(arg) for arg in args], file_format)
+        logging.info(f'[LABELS] {len(files)} files in {time.perf_counter() - started:.2f}s')
+        if not files:
+            await outbox.send(chat_id=message.chat.id, text='Техника не найдена')
+        for file in files:
+            await bot.send_document(message.chat.id, types.InputFile(file))
+
+
+async def send_qr_code(chat_id: int, equipment_id: int):
+    """
+    Send QR code of the equipment, images uploaded before are sent
+    by file_id without rendering and uploading
+    """
+    data = await aio.get_equipment_payload(equipment_id)
+    file_id = await aio.get_qr_file_id(data)
+    if file_id is not None:
+        try:
+            await bot.send_document(chat_id, file_id)
+            return
+        except BadRequest:
+            await aio.forget_qr_file_id(data)
+    file = await asyncio.get_event_loop().run_in_executor(None, qr_store.get_path, data)
+    message = await bot.send_document(
+        chat_id, types.InputFile(file, filename=f'{equipment_id}_qr.png'))
+    await aio.set_qr_file_id(data, message.document.file_id)
+    logging.info(f'[QR STORE] Uploaded QR code of {equipment_id}, {qr_store}')
+
+
+@dp.message_handler(commands='qr')
+async def get_qr_code(message: types.Message):
+    """
+    Send QR code of the equipment: /qr <id>
+    """
+    if not await aio.is_admin(message.chat.id):
+        return
+    try:
+        await send_qr_code(message.chat.id, int(message.get_args()))
+    except (ValueError, EquipmentDoesNotExist):
+        await outbox.send(chat_id=message.chat.id,
+                          text='Техника не найдена. Пример:\n/qr 12')
@@ -3,10 +3,20 @@ from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 import logging
 
-from interface.init_bot import dp, bot
+from interface.init_bot import dp, bot, outbox, decode_pool, qr_cache, qr_phash_cache
 from api import user, equipment, qr_code, transfer
+from api.exceptions import DecoderIsBusy
+from api.metrics import Counter
+from api.payload import get_equipment_id
+from db.executor import run_in_db
 import interface.buttons as buttons
-from interface.parse_data import parse_qr_code_data, parse_my_equipment_data, validate_qr_code
+from interface.parse_data import parse_qr_code_data, parse_my_equipment_data, validate_qr_code, \
+    validate_qr_codes
+
+# hit rates of QR code decoding tiers
+tier_stats = qr_code.TierStats()
+# photos by result: cached, read, not_recognized, error or busy
+decode_results = Counter('qr_decode_photos_total', 'Photos by result of reading QR codes', ['result'])
 
 
 class Take_Equipment(StatesGroup):
@@ -24,11 +34,11 @@ async def take_equipment_step_1(call: types.CallbackQuery):
     """
     Request a photo with QR code
     """
-    await bot.send_message(
+    await outbox.send(
         chat_id=call.message.chat.id,
         text="Отправьте фото с\
- QR кодом техники. QR код должен занимать <b>80% фото</b>(это можно сделать с помощью кадрирования). На одном фото должен быть <b>только один QR\
- код</b>.\nПосле отправки всех QR кодов напишите /ok",
+ QR кодами техники. На одном фото может быть <b>несколько QR кодов</b>,\
+ каждый из них должен быть хорошо виден.\nПосле отправки всех QR кодов напишите /ok",
         parse_mode=types.message.ParseMode.HTML,
     )
     await Take_Equipment.scan_qr_code.set()
@@ -41,42 +51,43 @@ async def take_equipment_step_1(call: types.CallbackQuery):
 )
 async def take_equipment_step_2(message: types.Message, state: FSMContext):
     """
-    Get QR code, read data from it and create transfer
+    Get QR codes, read data from them and create transfers
     """
-    # read data from user's photo with QR code
-    eq = await read_qr_code(message)
-    eq_buffer = await state.get_data()
-    if validate_qr_code(eq):
-        transformed_result = parse_qr_code_data(eq)  # get equipment name
-        # check if user has already taken that equipment
-        user_eq_data = equipment.get_equipment_by_holder(message.chat.id)
-        user_eq_names = [eq["name"] for eq in user_eq_data]
-
-        if (
-            transformed_result not in eq_buffer["equipment_names"]
-            and transformed_result not in user_eq_names
-        ):
-            await bot.send_message(chat_id=message.chat.id, text=transformed_result)
-            # write data to storage
-            await state.update_data(
-                user_items=eq_buffer["user_items"] + [eq],
-                equipment_names=eq_buffer["equipment_names"] + [transformed_result],
-                user_id=message.chat.id,
-            )
-            # create transfer
-            eq_data = equipment.get_equipment(int(eq.split()[0]))
-            transfer.create_transfer(
-                eq_data["id"], eq_data["holder"]["id"], message.chat.id
-            )
-        else:
-            await bot.send_message(
-                chat_id=message.chat.id, text="Вы уже взяли данную технику"
-            )
-    else:
-        await bot.send_message(
+    # read data from all QR codes on user's photo
+    # all codes are checked with one query
+    codes = validate_qr_codes(await read_qr_codes(message))
+    if not codes:
+        await outbox.send(
             chat_id=message.chat.id,
             text="Произошла ошибка в распознавании фото. Попробуйте ещё раз",
         )
+        return
+    eq_buffer = await state.get_data()
+    taken_ids = [get_equipment_id(code) for code in eq_buffer["user_items"]]
+    eq_data = equipment.get_equipment_list([get_equipment_id(code) for code in codes])
+    # skip equipment which is already in the list or held by the user
+    new_eq = [
+        eq for eq in eq_data
+        if eq["id"] not in taken_ids and eq["holder"]["id"] != message.chat.id
+    ]
+    if new_eq:
+        new_ids = [eq["id"] for eq in new_eq]
+        new_names = [eq["name"] for eq in new_eq]
+        await outbox.send(chat_id=message.chat.id, text="\n".join(new_names))
+        # write data to storage
+        await state.update_data(
+            user_items=eq_buffer["user_items"]
+            + [code for code in codes if get_equipment_id(code) in new_ids],
+            equipment_names=eq_buffer["equipment_names"] + new_names,
+            user_id=message.chat.id,
+        )
+        # create transfers
+        await run_in_db(transfer.create_transfers, new_ids, message.chat.id)
+    # codes of equipment deleted after the check are skipped
+    if len(new_eq) < len(eq_data):
+        text = "Вы уже взяли данную технику" if len(eq_data) == 1 \
+            else "Часть техники на фото вы уже взяли"
+        await outbox.send(chat_id=message.chat.id, text=text)
 
 
 @dp.message_handler(state=Take_Equipment.scan_qr_code, commands="ok")
@@ -86,15 +97,13 @@ async def take_equipment_step_3(message: types.Message, state: FSMContext):
     """
     eq_buffer = await state.get_data()  # list with equipment ids and names
     if eq_buffer["equipment_names"]:
-        await bot.send_message(
+        await outbox.send(
             chat_id=message.chat.id, text="Ожидайте подтверждения от администраторов"
         )
         await Take_Equipment.next()
-        await state.update_data(admin_messages=[])
-        for admin in user.get_admin_list():
-            await equipment_confirmation(admin["id"], message.chat.id, eq_buffer)
+        await equipment_confirmation(message.chat.id, eq_buffer, state)
     else:
-        await bot.send_message(
+        await outbox.send(
             chat_id=message.chat.id,
             text="Произошла ошибка. Необходимо отправить хотя\
  бы 1 QR код. Попробуйте ещё раз",
@@ -111,17 +120,17 @@ async def take_equipment_step_4_ok(call: types.CallbackQuery):
     state = dp.current_state(chat=user_id, user=user_id)
     messages_data = await state.get_data()
     try:
-        for message in messages_data["admin_messages"]:
-            await bot.delete_message(message.chat.id, message.message_id)
+        for chat_id, message_id in messages_data["admin_messages"]:
+            await bot.delete_message(chat_id, message_id)
     except Exception:
         logging.info(f"Deleting messages for {user_id} failed...")
-    await bot.send_message(
+    await outbox.send(
         chat_id=user_id,
         text="Ваша заявка на взятие техники\
  была подтверждена",
     )
     user_transfers = [trans["id"] for trans in transfer.get_active_transfers(user_id)]
-    list(map(transfer.verify_transfer, user_transfers))
+    await run_in_db(transfer.verify_transfers, user_transfers)
     await state.finish()
     logging.info(
         f"[TAKING EQUIPMENT] Administrator {call.message.chat.id}\
@@ -139,15 +148,15 @@ async def take_equipment_step_4_fail(call: types.CallbackQuery):
     state = dp.current_state(chat=user_id, user=user_id)
     messages_data = await state.get_data()
     try:
-        for message in messages_data["admin_messages"]:
-            await bot.delete_message(message.chat.id, message.message_id)
+        for chat_id, message_id in messages_data["admin_messages"]:
+            await bot.delete_message(chat_id, message_id)
     except Exception:
         logging.info(f"Deleting messages for {user_id} failed...")
-    await bot.send_message(
+    await outbox.send(
         chat_id=user_id, text="Ваша заявка на взятие техники была отклонена"
     )
     user_transfers = [trans["id"] for trans in transfer.get_active_transfers(user_id)]
-    list(map(transfer.delete_transfer, user_transfers))
+    await run_in_db(transfer.delete_transfers, user_transfers)
     await state.finish()
     logging.info(
         f"[TAKING EQUIPMENT] Administrator {call.message.chat.id}\
@@ -157,26 +166,100 @@ async def take_equipment_step_4_fail(call: types.CallbackQuery):
 
 async def read_qr_code(message: types.Message) -> str:
     """
-    Create file from user's photo with QR code and read it
+    Download user's photo with QR code into memory and read it.
+    Small thumbnail is tried first, full size photo only if it fails.
+    Photos which were already read are taken from the cache
     """
-    # create file
-    photo_id = str(message.photo[2].file_id)
-    photo = await bot.download_file_by_id(message.photo[2].file_id)
-    qr_code.save_photo(photo, photo_id)
-    try:
-        # read file
-        result = qr_code.get_qr_code_data(qr_code.get_file_path(photo_id))
-    except Exception as e:
-        logging.error(str(e))
-        result = ""
-    # delete file
-    qr_code.delete_file(qr_code.get_file_path(photo_id))
-    return result
+    return await decode_photo(message, qr_code.decode_qr_code, "") or ""
+
+
+async def read_qr_codes(message: types.Message) -> list:
+    """
+    Read all QR codes on user's photo the same way as read_qr_code
+    """
+    return await decode_photo(message, qr_code.decode_qr_codes, "multi ") or []
+
+
+async def decode_photo(message: types.Message, decode, prefix: str):
+    """
+    Decode the photo by the plan of sizes and tiers with the decode
+    function of api.qr_code. Keys of caches start with the prefix,
+    so results of different functions don't mix
+    """
+    key = prefix + message.photo[-1].file_unique_id
+    result = qr_cache.get(key)
+    if result is not None:
+        logging.info(f"[QR DECODING] Cache hit. Cache: {qr_cache}")
+        decode_results.labels("cached").inc()
+        return result
+    # don't download anything if there is no free place in the queue
+    if decode_pool.is_busy:
+        raise DecoderIsBusy(f'Decoder is busy, photo from {message.chat.id} skipped')
+    phash = None
+    failed = False
+    for photo_size, tiers in get_decoding_plan(message.photo):
+        photo = await bot.download_file_by_id(photo_size.file_id)
+        if qr_phash_cache is not None and phash is None:
+            # the same picture could be sent again as a new file
+            phash = prefix + qr_code.perceptual_hash(photo.getvalue())
+            result = qr_phash_cache.get(phash)
+            if result is not None:
+                logging.info(f"[QR DECODING] Cache hit by hash. Cache: {qr_phash_cache}")
+                decode_results.labels("cached").inc()
+                qr_cache.set(key, result)
+                return result
+        try:
+            # read photo in the worker process
+            result, tier = await decode_pool.run(decode, photo.getvalue(), tiers)
+        except DecoderIsBusy:
+            raise
+        except Exception as e:
+            # a failed thumbnail still leaves the larger size to try
+            logging.error(f"[QR DECODING] {tiers} failed: {e}")
+            failed = True
+            continue
+        tier_stats.record(tiers, tier)
+        if result:
+            logging.info(f"[QR DECODING] Read by {tier}. Hit rates: {tier_stats}")
+            decode_results.labels("read").inc()
+            qr_cache.set(key, result)
+            if phash is not None:
+                qr_phash_cache.set(phash, result)
+            return result
+    logging.info(f"[QR DECODING] Not recognized. Hit rates: {tier_stats}")
+    decode_results.labels("error" if failed else "not_recognized").inc()
+    return None
+
+
+def get_decoding_plan(photo: list) -> list:
+    """
+    Match photo sizes sent by Telegram with decoding tiers for them.
+    Sizes are sorted from the smallest to the largest one
+    """
+    if len(photo) == 1:
+        return [(photo[0], tuple(qr_code.TIERS))]
+    thumbnail = photo[1] if len(photo) > 2 else photo[0]
+    return [(thumbnail, ("as_is",)), (photo[-1], ("downscaled", "morph"))]
 
 
-async def equipment_confirmation(admin_id: int, user_id: int, eq_names: list):
+@dp.errors_handler(exception=DecoderIsBusy)
+async def decoder_is_busy(update: types.Update, exception: DecoderIsBusy):
     """
-    Confirm taking the equipment
+    Ask user to resend the photo later if all decoders are busy
+    """
+    logging.warning(str(exception))
+    decode_results.labels("busy").inc()
+    await outbox.send(
+        chat_id=update.message.chat.id,
+        text="Сейчас обрабатывается слишком много фото. Отправьте это фото\
+ ещё раз через несколько секунд",
+    )
+    return True
+
+
+async def equipment_confirmation(user_id: int, eq_names: dict, state: FSMContext):
+    """
+    Ask all admins to confirm taking the equipment
     """
     keyboard_interface = buttons.create_inline_markup(
         [{'text': '\U00002705', 'callback': f'conf_success {user_id}'},
@@ -190,17 +273,15 @@ async def equipment_confirmation(admin_id: int, user_id: int, eq_names: list):
         else f"[{user_id}]\
 (tg://user?id={user_id})"
     )
-    # save message data
-    message = await bot.send_message(
-        chat_id=admin_id,
+    messages = await outbox.notify_admins(
         text=f"Подтвердите передачу техники к {user_name}.\
  Список техники:\n{transformed_eq_names}",
         reply_markup=keyboard_interface,
         parse_mode="Markdown",
     )
-    state = dp.current_state()
-    messages_list = await state.get_data()
-    await state.update_data(admin_messages=messages_list["admin_messages"] + [message])
+    # save only addresses of messages, the storage keeps plain values
+    await state.update_data(
+        admin_messages=[(message.chat.id, message.message_id) for message in messages])
 
 
 class Scan_QR_Code(StatesGroup):
@@ -217,7 +298,7 @@ async def scan_qr_code_step_1(call: types.CallbackQuery):
     """
     Request a photo with QR code
     """
-    await bot.send_message(
+    await outbox.send(
         chat_id=call.message.chat.id,
         text="Отправьте фото с\
  QR кодом техники. QR код должен занимать <b>80% фото</b>(это можно сделать с\
@@ -236,9 +317,9 @@ async def scan_qr_code_step_2(message: types.Message, state: FSMContext):
     data = await read_qr_code(message)
     if validate_qr_code(data):
         result = parse_qr_code_data(data)
-        await bot.send_message(chat_id=message.chat.id, text=result)
+        await outbox.send(chat_id=message.chat.id, text=result)
     else:
-        await bot.send_message(
+        await outbox.send(
             chat_id=message.chat.id,
             text="Произошла ошибка в распознавании фото. Попробуйте ещё раз",
         )
@@ -250,7 +331,7 @@ async def scan_qr_code_step_4(message: types.Message, state: FSMContext):
     End scanning
     """
     await state.finish()
-    await bot.send_message(chat_id=message.chat.id, text="\U00002705")
+    await outbox.send(chat_id=message.chat.id, text="\U00002705")
 
 
 @dp.callback_query_handler(lambda call: call.data == "return_eq")
@@ -260,31 +341,22 @@ async def return_equipment(call: types.CallbackQuery):
     Return all equipment
     """
     user_eq_data = equipment.get_equipment_by_holder(call.message.chat.id)
-    # create transfer from user to storehouse
-    for eq in user_eq_data:
-        transfer.create_transfer(eq["id"], eq["holder"]["id"], 1)
-    # move transfer into history
-    user_transfers = [
-        transfer.get_transfer_by_equipment_id(eq["id"])["id"] for eq in user_eq_data
-    ]
-    list(map(transfer.verify_transfer, user_transfers))
-    list(map(transfer.delete_transfer, user_transfers))
+    # move all equipment to the storehouse and into history
+    await run_in_db(transfer.return_all, call.message.chat.id)
 
     transformed_result = parse_my_equipment_data(user_eq_data)
     username = call.message.chat.username or user.get_user(
         call.message.chat.id)['username']
     user_id = call.message.chat.id
-    for admin in user.get_admin_list():
-        await bot.send_message(
-            chat_id=admin["id"],
-            text="{} вернул(а) данную технику:\n{}".format(
-                f"@{username}"
-                if username is not None
-                else f"[{user_id}](tg://user?id={user_id})",
-                transformed_result,
-            ),
-        )
-    await bot.send_message(
+    await outbox.notify_admins(
+        text="{} вернул(а) данную технику:\n{}".format(
+            f"@{username}"
+            if username is not None
+            else f"[{user_id}](tg://user?id={user_id})",
+            transformed_result,
+        ),
+    )
+    await outbox.send(
         chat_id=user_id,
         text=f"Данная техника была успешно возвращена:\n{transformed_result}\
 \n\nЧтобы вернуться в главное меню напишите /start",
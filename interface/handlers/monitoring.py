@@ -1,15 +1,112 @@
 from aiogram import types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from datetime import date, timedelta
+from datetime import datetime
 
-from interface.init_bot import dp, bot
-from api import user, history, equipment
+from interface.init_bot import dp, outbox
+from api import user, history, equipment, aio
+from api.payload import get_equipment_id
 import interface.buttons as buttons
 from interface import parse_data as parse
 from interface.handlers.equipment import read_qr_code
 
 
+CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+DAY_FORMAT = '%Y%m%d'
+
+
+def history_filter(scope: str) -> dict:
+    """
+    Arguments of history.get_history_page for the scope of history:
+    'a' for all actions, 'u<user id>', 'e<equipment id>' or
+    'p<start>-<end>' for the period
+    """
+    kind, value = scope[0], scope[1:]
+    if kind == 'u':
+        return {'user_id': int(value)}
+    if kind == 'e':
+        return {'equipment_id': int(value)}
+    if kind == 'p':
+        start, end = value.split('-')
+        return {'start': datetime.strptime(start, DAY_FORMAT).date(),
+                'end': datetime.strptime(end, DAY_FORMAT).date()}
+    return {}
+
+
+def history_cursor(row: dict) -> str:
+    return f'{row["date"].strftime(CURSOR_FORMAT)}_{row["id"]}'
+
+
+def parse_history_cursor(cursor: str) -> tuple:
+    moment, id = cursor.split('_')
+    return datetime.strptime(moment, CURSOR_FORMAT), int(id)
+
+
+async def history_header(scope: str) -> str:
+    arguments = history_filter(scope)
+    if 'user_id' in arguments:
+        profile = await aio.get_profile(arguments['user_id'])
+        name = f"@{profile['username']}" if profile['username'] else profile['id']
+        return f'История {name}:'
+    if 'start' in arguments:
+        return f"История с {arguments['start']:%d.%m.%Y} по {arguments['end']:%d.%m.%Y}:"
+    return 'Последние действия:'
+
+
+def history_page(scope: str, header: str, data: list, has_newer: bool,
+                 has_older: bool, start: int) -> tuple:
+    """
+    Text and Prev/Next buttons of the page of history, newest first,
+    callback is 'hist <scope> <n|p> <cursor> <start>'
+    """
+    prev_callback = next_callback = None
+    if has_newer:
+        prev_callback = (f'hist {scope} p {history_cursor(data[0])} '
+                         f'{max(start - history.PAGE_SIZE, 0)}')
+    if has_older:
+        next_callback = f'hist {scope} n {history_cursor(data[-1])} {start + len(data)}'
+    if scope.startswith('e'):
+        text = parse.parse_equipment_history_data(data, start)\
+            + '\nЧтобы вернуться в главное меню напишите /start'
+    else:
+        text = f'{header}\n{parse.parse_history_data(data, start)}'
+    return text, buttons.create_page_markup(prev_callback, next_callback)
+
+
+async def send_history(chat_id: int, scope: str, empty_text: str):
+    """
+    Send the first page of history of the scope
+    """
+    data, has_newer, has_older = await aio.get_history_page(**history_filter(scope))
+    if not data:
+        await outbox.send(chat_id=chat_id, text=empty_text)
+        return
+    text, reply_markup = history_page(scope, await history_header(scope),
+                                      data, has_newer, has_older, 0)
+    await outbox.send(chat_id=chat_id, text=text, reply_markup=reply_markup,
+                      parse_mode=types.message.ParseMode.HTML)
+
+
+@dp.callback_query_handler(lambda call: call.data.startswith('hist '))
+async def get_history_page(call: types.CallbackQuery):
+    """
+    Show newer or older page of history in the same message
+    """
+    _, scope, direction, cursor, start = call.data.split()
+    cursor, start = parse_history_cursor(cursor), int(start)
+    if direction == 'n':
+        page = await aio.get_history_page(**history_filter(scope), before=cursor)
+    else:
+        page = await aio.get_history_page(**history_filter(scope), after=cursor)
+    if not page[0]:
+        await call.answer('Записей больше нет')
+        return
+    text, reply_markup = history_page(scope, await history_header(scope), *page, start)
+    await call.message.edit_text(
+        text, reply_markup=reply_markup, parse_mode=types.message.ParseMode.HTML)
+    await call.answer()
+
+
 class Get_User_History(StatesGroup):
     """
     Use states as events for getting user history
@@ -22,7 +119,7 @@ async def get_user_history_step_1(call: types.CallbackQuery):
     """
     Start of getting user history
     """
-    await bot.send_message(chat_id=call.message.chat.id, text='Отправьте тэг\
+    await outbox.send(chat_id=call.message.chat.id, text='Отправьте тэг\
  пользователя или его id.\nЧтобы узнать id пользователя воспользуйтесь\
  @userinfobot')
     await Get_User_History.waiting_for_user.set()
@@ -48,23 +145,15 @@ async def get_user_history_step_2(message: types.Message, state: FSMContext):
         user_data = int(message.text)
 
     if not exception_msg:
-        if user.is_exists(user_data):
-            user_history_data = history.get_user_history(user_data)
-            if user_history_data:
-                transformed_result = parse.parse_history_data(
-                    user_history_data)
-                await bot.send_message(
-                    chat_id=message.chat.id,
-                    text=f"История {message.text}:\n{transformed_result}",
-                    parse_mode=types.message.ParseMode.HTML)
-            else:
-                exception_msg = f'История {message.text} пуста'
+        if await aio.is_exists(user_data):
+            await send_history(message.chat.id, f'u{user_data}',
+                               f'История {message.text} пуста')
         else:
             exception_msg = 'Пользователя не существует'
 
     if exception_msg:
-        await bot.send_message(chat_id=message.chat.id,
-                               text=exception_msg)
+        await outbox.send(chat_id=message.chat.id,
+                          text=exception_msg)
     await state.finish()
 
 
@@ -80,7 +169,7 @@ async def get_period_history_step_1(call: types.CallbackQuery):
     """
     Start of getting history during specific period
     """
-    await bot.send_message(
+    await outbox.send(
         chat_id=call.message.chat.id,
         text=f'Отправьте начальную и конечную дату с новой строки.\
  Пример:\n20.12.2021\n22.12.2021')
@@ -96,22 +185,16 @@ async def get_period_history_step_2(message: types.Message, state: FSMContext):
     """
     data = message.text.split('\n')
     try:
-        period_data = history.get_history_by_period(
-            *[int(element) for date in data for element in date.split('.')])
-    except Exception:
-        await bot.send_message(chat_id=message.chat.id,
-                               text='Введённые даты неправильные. Попробуйте\
+        start, end = [datetime.strptime(line.strip(), '%d.%m.%Y').date()
+                      for line in data]
+    except ValueError:
+        await outbox.send(chat_id=message.chat.id,
+                          text='Введённые даты неправильные. Попробуйте\
  ещё раз')
     else:
-        if period_data:
-            transformed_result = parse.parse_history_data(period_data)
-            await bot.send_message(
-                chat_id=message.chat.id,
-                text=f"История с {data[0]} по {data[1]}:\n{transformed_result}",
-                parse_mode=types.message.ParseMode.HTML)
-        else:
-            await bot.send_message(chat_id=message.chat.id,
-                                text=f'История с {data[0]} по {data[1]} пуста.')
+        await send_history(message.chat.id,
+                           f'p{start:{DAY_FORMAT}}-{end:{DAY_FORMAT}}',
+                           f'История с {data[0]} по {data[1]} пуста.')
 
     await state.finish()
 
@@ -126,8 +209,8 @@ async def my_equipment(call: types.CallbackQuery):
     my_eq_data.reverse()
     transformed_result = parse.parse_my_equipment_data(my_eq_data)\
         or 'На данный момент у вас нет взятой техники'
-    await bot.send_message(chat_id=call.message.chat.id,
-                           text=transformed_result)
+    await outbox.send(chat_id=call.message.chat.id,
+                      text=transformed_result)
 
 
 class Get_Equipment_History(StatesGroup):
@@ -143,11 +226,11 @@ async def equipment_history_step_1(call: types.CallbackQuery):
     """
     Start getting history of equipment
     """
-    await bot.send_message(chat_id=call.message.chat.id, text='Отправьте\
+    await outbox.send(chat_id=call.message.chat.id, text='Отправьте\
  фото с QR кодом техники. QR код должен занимать <b>80% фото</b>(это можно\
  сделать с помощью кадрирования). На одном фото должен быть <b>только один QR\
  код</b>',
-                           parse_mode=types.message.ParseMode.HTML)
+                      parse_mode=types.message.ParseMode.HTML)
     await Get_Equipment_History.scan_qr_code.set()
 
 
@@ -160,21 +243,12 @@ async def equipment_history_step_2(message: types.Message, state: FSMContext):
     # read data from QR code
     data = await read_qr_code(message)
     if parse.validate_qr_code(data):
-        # find equipment history and parse data
-        eq_history_data = history.get_equipment_history(
-            int(data.split()[0]))
-        if eq_history_data:
-            transformed_result = parse.parse_equipment_history_data(
-                eq_history_data)
-        else:
-            transformed_result = 'История техники пуста'
-        await bot.send_message(
-        chat_id=message.chat.id,
-        text=transformed_result+'\nЧтобы вернуться в главное меню\
- напишите /start',
-            parse_mode=types.message.ParseMode.HTML)
+        # find equipment history and send its first page
+        await send_history(message.chat.id, f'e{get_equipment_id(data)}',
+                           'История техники пуста\nЧтобы вернуться в главное\
+ меню напишите /start')
     else:
-        await bot.send_message(
+        await outbox.send(
             chat_id=message.chat.id,
             text='Произошла ошибка в распознавании фото. Попробуйте ещё раз')
     await state.finish()
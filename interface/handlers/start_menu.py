@@ -1,12 +1,13 @@
+import asyncio
 from aiogram import types
 from logging import info, warning
 
-from interface.init_bot import dp, bot
+from interface.init_bot import dp, outbox
 import interface.buttons as buttons
 from interface.handlers import user_verification, equipment, monitoring, admin_panel
 from interface import parse_data as parse
 
-from api import user, category, history
+from api import category, aio
 
 
 @dp.callback_query_handler(lambda call: call.data == 'start_menu')
@@ -20,24 +21,24 @@ async def start_menu(call):
     username = message.chat.username or None
     # add user to the db
     registration_flag = False
-    if not user.is_exists(message.chat.id):
+    if not await aio.is_exists(message.chat.id):
         registration_flag = True
-        user.create_user(message.chat.id, message.chat.full_name, username)
-        await bot.send_message(
+        await aio.create_user(message.chat.id, message.chat.full_name, username)
+        await outbox.send(
             chat_id=message.chat.id,
             text='Ожидайте подтверждения от администраторов')
         # verify user
         await user_verification.notify_admins(message, username)
-    if user.is_verified(message.chat.id):
+    if await aio.is_verified(message.chat.id):
         # check if username in the DB is up to date
-        check_username(message)
+        await check_username(message)
         keyboard_interface = types.InlineKeyboardMarkup(row_width=1).add(
-            *buttons.create_start_menu_buttons(message.chat.id))
-        await bot.send_message(chat_id=message.chat.id,
-                               text='Привет! Выберите действие ниже',
-                               reply_markup=keyboard_interface)
+            *await buttons.create_start_menu_buttons(message.chat.id))
+        await outbox.send(chat_id=message.chat.id,
+                          text='Привет! Выберите действие ниже',
+                          reply_markup=keyboard_interface)
     elif not registration_flag:
-        await bot.send_message(chat_id=message.chat.id, text='Извините, вы не\
+        await outbox.send(chat_id=message.chat.id, text='Извините, вы не\
  верифицированы. В случае, если это ошибка, обратитесь к администраторам')
 
 
@@ -47,34 +48,70 @@ async def open_categories(call: types.CallbackQuery):
     """
     Show categories selection
     """
-    await bot.send_message(chat_id=call.message.chat.id,
-                           text='Выберите категорию техники',
-                           reply_markup=buttons.create_categories_buttons())
+    await outbox.send(chat_id=call.message.chat.id,
+                      text='Выберите категорию техники',
+                      reply_markup=buttons.create_categories_buttons())
 
 
 @dp.callback_query_handler(lambda call: call.data.startswith('category'))
 async def get_category_equipment_list(call: types.CallbackQuery):
     """
-    Get list of tech from specific category
+    Get first page of tech from specific category
     """
     # create list of categories from DB
-    categories = [cat['name'] for cat in category.get_all_categories()]
+    categories = [cat['name'] for cat in await aio.get_all_categories()]
     try:
-        data = category.get_category_equipment(categories.index(
-            call.data.split()[1]) + 1)
-    except Exception:
-        data = []
-        await bot.send_message(chat_id=call.message.chat_id,
-                               text='Данной категории не существует')
-    # TODO: write pages for equipment list of the category
-    if data:
-        transformed_data = parse.parse_category_equipment_data(data)[0]
-        await bot.send_message(
-            chat_id=call.message.chat.id,
-            text=transformed_data, parse_mode=types.message.ParseMode.HTML)
+        category_id = categories.index(call.data.split()[1]) + 1
+    except (ValueError, IndexError):
+        await outbox.send(chat_id=call.message.chat.id,
+                          text='Данной категории не существует')
+        return
+    page = await aio.get_category_equipment_page(category_id)
+    if page[0]:
+        text, reply_markup = category_page(category_id, *page, start=0)
+        await outbox.send(
+            chat_id=call.message.chat.id, text=text, reply_markup=reply_markup,
+            parse_mode=types.message.ParseMode.HTML)
+    else:
+        await outbox.send(chat_id=call.message.chat.id,
+                          text='В данной категории нет техники')
+
+
+@dp.callback_query_handler(lambda call: call.data.startswith('cat_page'))
+async def get_category_equipment_page(call: types.CallbackQuery):
+    """
+    Show previous or next page of tech from specific category
+    in the same message
+    """
+    _, category_id, direction, cursor, start = call.data.split()
+    category_id, cursor, start = int(category_id), int(cursor), int(start)
+    if direction == 'n':
+        page = await aio.get_category_equipment_page(category_id, after=cursor)
     else:
-        await bot.send_message(chat_id=call.message.chat.id,
-                               text='В данной категории нет техники')
+        page = await aio.get_category_equipment_page(category_id, before=cursor)
+    if not page[0]:
+        await call.answer('Техники больше нет')
+        return
+    text, reply_markup = category_page(category_id, *page, start=start)
+    await call.message.edit_text(
+        text, reply_markup=reply_markup, parse_mode=types.message.ParseMode.HTML)
+    await call.answer()
+
+
+def category_page(category_id: int, data: list, has_previous: bool,
+                  has_next: bool, start: int) -> tuple:
+    """
+    Text and Prev/Next buttons of the page of category equipment,
+    callback is 'cat_page <category id> <n|p> <equipment id> <start>'
+    """
+    prev_callback = next_callback = None
+    if has_previous:
+        prev_callback = (f'cat_page {category_id} p {data[0]["id"]} '
+                         f'{max(start - category.PAGE_SIZE, 0)}')
+    if has_next:
+        next_callback = f'cat_page {category_id} n {data[-1]["id"]} {start + len(data)}'
+    text = parse.parse_category_equipment_data(data, start)[0]
+    return text, buttons.create_page_markup(prev_callback, next_callback)
 
 
 @dp.callback_query_handler(lambda call: call.data == 'get_history')
@@ -83,25 +120,29 @@ async def get_history(call: types.CallbackQuery):
     """
     Show history
     """
-    data = history.get_last_actions(count=20)
+    (data, _, has_older), admin = await asyncio.gather(
+        aio.get_history_page(), aio.is_admin(call.message.chat.id))
     history_buttons = [
         {'text': 'За период времени', 'callback': 'during_time'},
         {'text': 'Моя техника', 'callback': 'my_eq'},
         {'text': 'История техники', 'callback': 'eq_history'}]
-    if user.is_admin(call.message.chat.id):
+    if admin:
         history_buttons += [
             {'text': 'История пользователя', 'callback': 'user_history'}]
+    if has_older:
+        history_buttons += [
+            {'text': 'Ранее', 'callback': f'hist a n {monitoring.history_cursor(data[-1])} {len(data)}'}]
     if data:
         transformed_data = parse.parse_history_data(data)
-        await bot.send_message(
+        await outbox.send(
             chat_id=call.message.chat.id,
             text=transformed_data,
             reply_markup=buttons.create_inline_markup(history_buttons),
             parse_mode=types.message.ParseMode.HTML)
     else:
-        await bot.send_message(chat_id=call.message.chat.id,
-                               text='История пуста',
-                               reply_markup=buttons.create_inline_markup(
+        await outbox.send(chat_id=call.message.chat.id,
+                          text='История пуста',
+                          reply_markup=buttons.create_inline_markup(
                                     history_buttons, row_width=2))
 
 
@@ -119,19 +160,18 @@ async def admin_menu(call: types.CallbackQuery):
          {'text': 'Изменить описание', 'callback': 'change_desc'},
          {'text': 'Вернуться назад', 'callback': 'start_menu'}], row_width=2)
 
-    await bot.send_message(chat_id=call.message.chat.id,
-                           text='Привет! Выберите действие ниже',
-                           reply_markup=admin_markup)
+    await outbox.send(chat_id=call.message.chat.id,
+                      text='Привет! Выберите действие ниже',
+                      reply_markup=admin_markup)
 
 
-def check_username(message: types.Message):
+async def check_username(message: types.Message):
     """
     Check if username in the DB is up to date and change it if it is not
     """
-    try:
-        user.get_user_by_username(message.chat.username)
-    except Exception:
-        user.change_username(message.chat.id, message.chat.username)
+    profile = await aio.get_profile(message.chat.id)
+    if profile['username'] != message.chat.username:
+        await aio.change_username(message.chat.id, message.chat.username)
 
 
 @dp.message_handler(commands='cancel', state="*")
@@ -142,4 +182,4 @@ async def cancel_current_state(message: types.Message):
     state = dp.current_state()
     info(f'[CANCELLING] Cancelling state ({state}) by {message.chat.id}...')
     await state.finish()
-    await bot.send_message(chat_id=message.chat.id, text='\U0001F44C')
+    await outbox.send(chat_id=message.chat.id, text='\U0001F44C')
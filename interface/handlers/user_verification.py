@@ -2,9 +2,9 @@ from aiogram import types
 from aiogram.dispatcher.filters.state import State, StatesGroup
 import logging
 
-from interface.init_bot import dp, bot
+from interface.init_bot import dp, bot, outbox
 import interface.buttons as buttons
-from api import user
+from api import aio
 
 
 class Verification(StatesGroup):
@@ -18,28 +18,22 @@ async def notify_admins(message: types.Message, username: str):
     await Verification.waiting_for_action.set()
     state = dp.current_state()
     await state.update_data(admin_messages=[])
-    for admin in user.get_admin_list():
-        await verification(
-        admin_id=admin['id'], user_id=message.chat.id,
-        username=username)
+    await verification(user_id=message.chat.id, username=username)
 
 
-async def verification(admin_id: int, user_id: int,
-                       username: str = None):
+async def verification(user_id: int, username: str = None):
     keyboard_interface = buttons.create_inline_markup(
         [{'text': '\U00002705', 'callback': f'verification success {user_id}'},
          {'text': '\U0000274C', 'callback': f'verification failed {user_id}'}])
     user_name = f'@{username}' if username is not None else \
         f'[{user_id}](tg://user?id={user_id})'
-    message = await bot.send_message(
-        chat_id=admin_id,
+    messages = await outbox.notify_admins(
         text=f"Подтвердите пользователя {user_name}",
         reply_markup=keyboard_interface)
-    # save message data
+    # save ids of messages, the storage keeps only plain values
     state = dp.current_state()
-    messages_list = await state.get_data()
     await state.update_data(
-        admin_messages=messages_list['admin_messages'] + [message])
+        admin_messages=[(message.chat.id, message.message_id) for message in messages])
 
 
 @dp.callback_query_handler(lambda call:
@@ -50,10 +44,10 @@ async def verification_success(call: types.CallbackQuery):
     user_id = int(call.data.split()[2])
     state = dp.current_state(chat=user_id, user=user_id)
     messages_data = await state.get_data()
-    for message in messages_data['admin_messages']:
-        await bot.delete_message(message.chat.id, message.message_id)
-    user.verify_user(user_id)
-    await bot.send_message(chat_id=user_id, text='Вы получили доступ к боту.\
+    for chat_id, message_id in messages_data['admin_messages']:
+        await bot.delete_message(chat_id, message_id)
+    await aio.verify_user(user_id)
+    await outbox.send(chat_id=user_id, text='Вы получили доступ к боту.\
  Пропишите /start для использования')
     await state.finish()
     logging.info(f'[USER VERIFICATION] Administrator {call.message.chat.id}\
@@ -68,10 +62,10 @@ async def verification_failed(call: types.CallbackQuery):
     user_id = int(call.data.split()[2])
     state = dp.current_state(chat=user_id, user=user_id)
     messages_data = await state.get_data()
-    for message in messages_data['admin_messages']:
-        await bot.delete_message(message.chat.id, message.message_id)
-    await bot.send_message(chat_id=user_id,
-                           text='Администраторы отклонили вашу заявку')
+    for chat_id, message_id in messages_data['admin_messages']:
+        await bot.delete_message(chat_id, message_id)
+    await outbox.send(chat_id=user_id,
+                      text='Администраторы отклонили вашу заявку')
     await state.finish()
     logging.info(f'[USER VERIFICATION] Administrator {call.message.chat.id}\
  declined verification of the user {user_id}')
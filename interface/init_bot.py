@@ -2,12 +2,49 @@ from aiogram import Bot, Dispatcher
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 import logging
 
-from config import TOKEN
+import config
+from api.decoder import DecodePool
+from api.cache import TTLCache
+from api import payload
+from api.qr_store import QRStore
+from interface.notifications import Notifier
+from interface.outbox import Outbox
+from interface.storage import SQLiteStorage
 
 # configure logging
 logging.basicConfig(level=logging.INFO)
 
 # initialize bot and dispatcher
-bot = Bot(token=TOKEN)
-memory_storage = MemoryStorage()
-dp = Dispatcher(bot, storage=memory_storage)
+bot = Bot(token=config.TOKEN)
+# conversations are kept in the database unless FSM_STORAGE is 'memory'
+storage = MemoryStorage() if getattr(config, 'FSM_STORAGE', 'sqlite') == 'memory' \
+    else SQLiteStorage(ttl=getattr(config, 'FSM_TTL', 24*60*60))
+dp = Dispatcher(bot, storage=storage)
+notifier = Notifier(
+    bot,
+    rate=getattr(config, 'NOTIFY_RATE', 25),
+    chat_rate=getattr(config, 'NOTIFY_CHAT_RATE', 1),
+    chat_burst=getattr(config, 'NOTIFY_CHAT_BURST', 3))
+outbox = Outbox(notifier)
+
+# key of signed QR codes, new codes are legacy '<id> <control>' without it
+payload.set_secret(getattr(config, 'QR_SECRET', ''))
+
+# worker processes for QR code decoding
+decode_pool = DecodePool(
+    workers=getattr(config, 'QR_WORKERS', 2),
+    max_queue=getattr(config, 'QR_QUEUE_SIZE', 8),
+    timeout=getattr(config, 'QR_TIMEOUT', 15))
+
+# decoded QR codes by file_unique_id of the photo
+qr_cache = TTLCache(
+    maxsize=getattr(config, 'QR_CACHE_SIZE', 1024),
+    ttl=getattr(config, 'QR_CACHE_TTL', 24*60*60))
+# decoded QR codes by perceptual hash of the photo thumbnail, disabled by default
+qr_phash_cache = TTLCache(
+    maxsize=getattr(config, 'QR_CACHE_SIZE', 1024),
+    ttl=getattr(config, 'QR_CACHE_TTL', 24*60*60)) \
+    if getattr(config, 'QR_CACHE_PHASH', False) else None
+
+# rendered QR codes of equipment
+qr_store = QRStore(max_bytes=getattr(config, 'QR_STORE_SIZE', 64*1024*1024))
@@ -0,0 +1,115 @@
+"""
+Metrics of the bot for Prometheus: timings of handlers, queues, caches
+and decoding. They are served on /metrics of a separate server, not on
+the public webhook server
+"""
+import logging
+import time
+from functools import wraps
+
+from aiogram import Dispatcher
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher.handler import Handler
+from aiohttp import web
+
+from api.metrics import REGISTRY, Counter, Gauge, Histogram
+from interface.init_bot import dp, outbox, notifier, decode_pool, qr_cache, qr_phash_cache, qr_store
+from interface.handlers.equipment import tier_stats
+from interface.storage import SQLiteStorage
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+handler_seconds = Histogram('handler_seconds', 'Duration of update handlers', ['handler'])
+# updated on every request of metrics
+fsm_sessions = Gauge('fsm_sessions', 'Conversations which are not finished')
+
+# statistics which are already collected by the bot
+Counter('qr_decode_tier_attempts_total', 'Attempts of QR code decoding tiers', ['tier'],
+        function=lambda: tier_stats.attempts)
+Counter('qr_decode_tier_hits_total', 'Successes of QR code decoding tiers', ['tier'],
+        function=lambda: tier_stats.hits)
+Gauge('qr_decode_pending', 'Decoding jobs running or waiting for a worker',
+      function=lambda: decode_pool.pending)
+
+
+def qr_caches() -> dict:
+    caches = {'file': qr_cache, 'phash': qr_phash_cache}
+    return {name: cache for name, cache in caches.items() if cache is not None}
+
+
+Counter('qr_cache_hits_total', 'Hits of caches of decoded QR codes', ['cache'],
+        function=lambda: {name: cache.hits for name, cache in qr_caches().items()})
+Counter('qr_cache_misses_total', 'Misses of caches of decoded QR codes', ['cache'],
+        function=lambda: {name: cache.misses for name, cache in qr_caches().items()})
+Gauge('qr_cache_entries', 'Entries in caches of decoded QR codes', ['cache'],
+      function=lambda: {name: len(cache) for name, cache in qr_caches().items()})
+Gauge('outbox_depth', 'Messages waiting in the outbox', function=lambda: outbox.depth)
+Counter('outbox_sent_total', 'Messages sent from the outbox', function=lambda: outbox.sent)
+Counter('outbox_coalesced_total', 'Messages joined with other messages to the same chat',
+        function=lambda: outbox.coalesced)
+Counter('notifier_messages_total', 'Messages to Telegram by result', ['result'],
+        function=lambda: {'sent': notifier.sent, 'failed': notifier.failed, 'retried': notifier.retried})
+Counter('qr_store_hits_total', 'QR code images found rendered', function=lambda: qr_store.hits)
+Counter('qr_store_rendered_total', 'QR code images rendered', function=lambda: qr_store.rendered)
+Counter('qr_store_evicted_total', 'QR code images removed to free space',
+        function=lambda: qr_store.evicted)
+Gauge('qr_store_bytes', 'Size of rendered QR code images', function=lambda: qr_store.size)
+Counter('fsm_expired_total', 'Conversations dropped after their time to live',
+        function=lambda: getattr(dp.storage, 'expired', 0))
+
+
+def timed_handler(handler):
+    histogram = handler_seconds.labels(handler.__name__)
+
+    @wraps(handler)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    return wrapper
+
+
+def instrument_dispatcher(dp: Dispatcher):
+    """
+    Time every handler of the dispatcher. Call it once,
+    after all handlers are registered
+    """
+    count = 0
+    for handlers in vars(dp).values():
+        if isinstance(handlers, Handler) and handlers is not dp.updates_handler:
+            for handler_obj in handlers.handlers:
+                # arguments are still matched with the spec of the original handler
+                handler_obj.handler = timed_handler(handler_obj.handler)
+                count += 1
+    logging.info(f'[METRICS] Timing {count} handlers')
+
+
+async def count_sessions(storage) -> int:
+    if isinstance(storage, SQLiteStorage):
+        return await storage.count()
+    if isinstance(storage, MemoryStorage):
+        return sum(1 for chat in storage.data.values() for record in chat.values()
+                   if record['state'] is not None or record['data'])
+    return 0
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    fsm_sessions.set(await count_sessions(dp.storage))
+    return web.Response(body=REGISTRY.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+
+async def start_metrics_server(host: str = '127.0.0.1', port: int = 9090) -> web.AppRunner:
+    """
+    Serve /metrics on a separate port
+    """
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    # scrapes are not written to the log
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f'[METRICS] Serving metrics on {host}:{port}/metrics')
+    return runner
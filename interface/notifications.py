@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot, types
+from aiogram.utils.exceptions import RetryAfter, TelegramAPIError
+
+from api.metrics import Histogram
+
+# seconds between removals of idle buckets of chats
+PRUNE_INTERVAL = 60
+
+# only the request, waiting for rate limits is not included
+send_seconds = Histogram('telegram_send_message_seconds', 'Duration of sendMessage requests')
+
+
+class TokenBucket:
+    """
+    Allow rate actions per second with bursts up to capacity
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def is_idle(self, now: float) -> bool:
+        """
+        The bucket has refilled, a new one would be the same
+        """
+        return now - self._updated > self._capacity / self._rate
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+class Notifier:
+    """
+    Send messages within Telegram limits: about 30 messages per second
+    in total and about one message per second to the same chat
+    """
+
+    def __init__(self, bot: Bot, rate: float = 25, chat_rate: float = 1,
+                 chat_burst: int = 3, retries: int = 3):
+        self._bot = bot
+        self._bucket = TokenBucket(rate, rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chat_buckets = {}
+        self._pruned_at = time.monotonic()
+        self._retries = retries
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        now = time.monotonic()
+        if now - self._pruned_at > PRUNE_INTERVAL:
+            # buckets of chats which got nothing for a while are full again
+            self._pruned_at = now
+            self._chat_buckets = {chat: bucket for chat, bucket in self._chat_buckets.items()
+                                  if not bucket.is_idle(now)}
+        if chat_id not in self._chat_buckets:
+            self._chat_buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+        return self._chat_buckets[chat_id]
+
+    async def send(self, chat_id: int, text: str, **kwargs) -> types.Message:
+        """
+        Send message waiting for rate limits, retry if Telegram asks to
+        """
+        for _ in range(self._retries):
+            await self._chat_bucket(chat_id).acquire()
+            await self._bucket.acquire()
+            try:
+                with send_seconds.time():
+                    message = await self._bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            except RetryAfter as e:
+                self.retried += 1
+                logging.warning(f'[NOTIFICATIONS] Flood control for {chat_id}, retry in {e.timeout}s')
+                await asyncio.sleep(e.timeout)
+            except TelegramAPIError as e:
+                logging.error(f'[NOTIFICATIONS] {e}')
+                break
+            else:
+                self.sent += 1
+                return message
+        self.failed += 1
+        logging.error(f'[NOTIFICATIONS] Message to {chat_id} was not sent')
+        return None
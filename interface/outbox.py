@@ -0,0 +1,276 @@
+import asyncio
+import itertools
+import logging
+import re
+import time
+
+from aiogram import types
+
+from api import aio
+from interface.notifications import Notifier
+
+# priorities of messages, lower is sent earlier
+INTERACTIVE = 0  # replies to user's actions
+NOTIFICATION = 1  # messages to admins
+DIGEST = 2  # reminders from the daemon
+
+MESSAGE_LIMIT = 4096
+# room for tags which are closed and opened again at the borders of parts
+HTML_RESERVE = 256
+MARKDOWN_RESERVE = 6
+
+HTML_TAG = re.compile(r'<(/?)([a-zA-Z-]+)[^>]*>')
+# entities of Markdown can't be nested, the longest marker goes first
+MARKDOWN_MARKERS = ('```', '`', '*', '_')
+
+# messages with only these options can be joined into one
+COALESCE_OPTIONS = {'parse_mode', 'disable_web_page_preview', 'disable_notification'}
+
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT, html: bool = False,
+               markdown: bool = False) -> list:
+    """
+    Split text into parts not longer than limit, by lines if possible.
+    HTML tags and entities, Markdown links and escaped characters
+    are not cut in two
+    """
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit)
+        if cut <= 0:
+            cut = limit
+        if html:
+            tag = text.rfind('<', 0, cut)
+            if tag > text.rfind('>', 0, cut):
+                cut = tag
+            entity = text.rfind('&', 0, cut)
+            if entity > text.rfind(';', 0, cut) and cut - entity <= 10:
+                cut = entity
+            if cut <= 0:
+                cut = limit
+        if markdown:
+            link = text.rfind('[', 0, cut)
+            if link > text.rfind(')', 0, cut):
+                cut = link
+            if cut > 0 and text[cut - 1] == '\\':
+                cut -= 1
+            if cut <= 0:
+                cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    parts.append(text)
+    return parts
+
+
+def split_html(text: str, limit: int = MESSAGE_LIMIT) -> list:
+    """
+    Split HTML text into parts which are valid on their own:
+    tags open at the end of a part are closed in it and opened
+    again at the start of the next one
+    """
+    parts = []
+    opened = []  # (name, opening tag)
+    for part in split_text(text, limit - HTML_RESERVE, html=True):
+        prefix = ''.join(tag for _, tag in opened)
+        for match in HTML_TAG.finditer(part):
+            name = match.group(2).lower()
+            if not match.group(1):
+                opened.append((name, match.group(0)))
+                continue
+            for i in range(len(opened) - 1, -1, -1):
+                if opened[i][0] == name:
+                    del opened[i]
+                    break
+        suffix = ''.join(f'</{name}>' for name, _ in reversed(opened))
+        parts.append(prefix + part + suffix)
+    return parts
+
+
+def markdown_entity(text: str, opened: str = None) -> str:
+    """
+    Get marker of the Markdown entity which is open at the end
+    of the text, opened is the one open at its start
+    """
+    i = 0
+    while i < len(text):
+        if opened not in ('```', '`'):
+            if text[i] == '\\':
+                i += 2
+                continue
+            if text[i] == '[' and opened is None:
+                # markers in links are not entities
+                end = text.find(')', i)
+                i = end + 1 if end != -1 else len(text)
+                continue
+        marker = next((marker for marker in MARKDOWN_MARKERS if text.startswith(marker, i)), None)
+        if marker is not None and opened in (None, marker):
+            opened = None if opened else marker
+            i += len(marker)
+        else:
+            i += 1
+    return opened
+
+
+def split_markdown(text: str, limit: int = MESSAGE_LIMIT) -> list:
+    """
+    Split Markdown text into parts which are valid on their own:
+    an entity open at the end of a part is closed in it and opened
+    again at the start of the next one
+    """
+    parts = []
+    opened = None
+    for part in split_text(text, limit - MARKDOWN_RESERVE, markdown=True):
+        prefix = opened or ''
+        opened = markdown_entity(part, opened)
+        parts.append(prefix + part + (opened or ''))
+    return parts
+
+
+class Outgoing:
+    """
+    Pending message, several texts for one chat can be joined in it
+    """
+
+    def __init__(self, chat_id: int, text: str, options: dict):
+        self.chat_id = chat_id
+        self.texts = [text]
+        self.options = options
+        self.futures = []
+
+
+class Outbox:
+    """
+    Queue of all outgoing messages. Messages are sent by priority,
+    pending messages to the same chat are joined, long texts are split
+    """
+
+    def __init__(self, notifier: Notifier, workers: int = 8):
+        self._notifier = notifier
+        self._workers_count = workers
+        self._workers = []
+        self._queue = asyncio.PriorityQueue()
+        self._order = itertools.count()
+        self._pending = {}
+        # last queued message of every chat, only it can be joined with new ones
+        self._tails = {}
+        # chat id: [lock, number of messages using it]
+        self._chat_locks = {}
+        self.sent = 0
+        self.coalesced = 0
+        self._started = time.monotonic()
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def throughput(self) -> float:
+        """
+        Sent messages per second since start
+        """
+        return self.sent / max(time.monotonic() - self._started, 1)
+
+    def _coalesce_key(self, chat_id: int, priority: int, options: dict):
+        if not set(options) <= COALESCE_OPTIONS:
+            return None
+        return chat_id, priority, tuple(sorted(options.items()))
+
+    async def send(self, chat_id: int, text: str, priority: int = INTERACTIVE, **options) -> types.Message:
+        """
+        Put message into the queue and wait until it is sent,
+        return the sent message or None if sending failed
+        """
+        self._start_workers()
+        future = asyncio.get_event_loop().create_future()
+        key = self._coalesce_key(chat_id, priority, options)
+        pending = self._pending.get(key)
+        # joining with an earlier message would send the text before messages queued after it
+        if pending is not None and self._tails.get(chat_id) is pending:
+            pending.texts.append(text)
+            pending.futures.append(future)
+            self.coalesced += 1
+        else:
+            message = Outgoing(chat_id, text, options)
+            message.futures.append(future)
+            if key is not None:
+                self._pending[key] = message
+            self._tails[chat_id] = message
+            self._queue.put_nowait((priority, next(self._order), key, message))
+        return await future
+
+    async def notify_admins(self, text: str, priority: int = NOTIFICATION, **options) -> list:
+        """
+        Send the message to all admins at once, return sent messages
+        """
+        start = time.perf_counter()
+        admins = await aio.get_admin_list()
+        messages = await asyncio.gather(
+            *[self.send(admin['id'], text, priority, **options) for admin in admins])
+        logging.info(f'[NOTIFICATIONS] Sent to {len(admins)} admins in '
+                     f'{(time.perf_counter() - start) * 1000:.0f}ms. Outbox: {self}')
+        return [message for message in messages if message is not None]
+
+    async def close(self):
+        """
+        Stop workers, messages left in the queue are not sent
+        """
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def _start_workers(self):
+        if not self._workers:
+            self._workers = [asyncio.ensure_future(self._work()) for _ in range(self._workers_count)]
+
+    async def _work(self):
+        while True:
+            _, _, key, message = await self._queue.get()
+            # nothing can be joined to the message after this point
+            if key is not None and self._pending.get(key) is message:
+                del self._pending[key]
+            if self._tails.get(message.chat_id) is message:
+                del self._tails[message.chat_id]
+            # keep the order of messages in every chat
+            entry = self._chat_locks.setdefault(message.chat_id, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    result = await self._deliver(message)
+            finally:
+                entry[1] -= 1
+                # locks of idle chats are not kept
+                if not entry[1]:
+                    del self._chat_locks[message.chat_id]
+            for future in message.futures:
+                if not future.done():
+                    future.set_result(result)
+
+    async def _deliver(self, message: Outgoing) -> types.Message:
+        options = dict(message.options)
+        text = '\n\n'.join(message.texts)
+        parse_mode = str(options.get('parse_mode', '')).lower()
+        if parse_mode == 'html':
+            parts = split_html(text)
+        elif parse_mode == 'markdown':
+            parts = split_markdown(text)
+        else:
+            parts = split_text(text)
+        reply_markup = options.pop('reply_markup', None)
+        result = None
+        for i, part in enumerate(parts):
+            # keyboard goes with the last part
+            if i == len(parts) - 1 and reply_markup is not None:
+                options['reply_markup'] = reply_markup
+            try:
+                result = await self._notifier.send(message.chat_id, part, **options)
+            except Exception as e:
+                logging.error(f'[OUTBOX] {e}')
+                result = None
+            if result is not None:
+                self.sent += 1
+        return result
+
+    def __str__(self):
+        return (f'{self.depth} queued, {self.sent} sent ({self.throughput:.2f}/s), '
+                f'{self.coalesced} coalesced')
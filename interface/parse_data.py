@@ -1,8 +1,9 @@
-from api.equipment import get_equipment, validate_control_sum
+from api.equipment import get_equipment, get_controls
+from api import payload
 import logging
 
 
-def parse_category_equipment_data(source: list) -> str:
+def parse_category_equipment_data(source: list, start: int = 0) -> str:
     """
     Parse data from category table from DB in format
     \nn. equipment_name
@@ -29,7 +30,7 @@ def parse_category_equipment_data(source: list) -> str:
         )
 
         transformed_data.append(
-            f"<b>{i+1}. {value['name']}\
+            f"<b>{start+i+1}. {value['name']}\
 </b>\nВладелец техники {owner}\n\
 Сейчас техника у {holder}\n\
 Описание: {value['description']}"
@@ -37,7 +38,7 @@ def parse_category_equipment_data(source: list) -> str:
     return "\n\n".join(transformed_data), len(transformed_data)
 
 
-def parse_history_data(source: list) -> str:
+def parse_history_data(source: list, start: int = 0) -> str:
     """
     Parse data from history table from DB in format
     \nn. equipment name
@@ -64,7 +65,7 @@ def parse_history_data(source: list) -> str:
         )
 
         transformed_data.append(
-            f"<b>{i+1}. {value['equipment']['name']}\
+            f"<b>{start+i+1}. {value['equipment']['name']}\
 </b>\nВзято у {source_user}\n\
 Передано {dest}\n\
 Дата и время: {isoformat_to_informal(value['date'])}"
@@ -72,7 +73,7 @@ def parse_history_data(source: list) -> str:
     return "\n".join(transformed_data)
 
 
-def parse_equipment_history_data(source: list) -> str:
+def parse_equipment_history_data(source: list, start: int = 0) -> str:
     """
     Parse data from history table from DB in format
     \nn.date and time
@@ -97,7 +98,7 @@ def parse_equipment_history_data(source: list) -> str:
             else f"[{dest_user_id}](tg://user?id={dest_user_id})"
         )
         transformed_data.append(
-            f"<b>{i+1}. {isoformat_to_informal(value['date'])}\
+            f"<b>{start+i+1}. {isoformat_to_informal(value['date'])}\
 </b>\nВзято у {source_user}\nПередано {dest}"
         )
     return source[0]["equipment"]["name"] + "\n" + "\n".join(transformed_data)
@@ -109,7 +110,7 @@ def parse_qr_code_data(source: str) -> str:
     \n equipment name
     """
     try:
-        equipment_data = get_equipment(int(source.split()[0]))
+        equipment_data = get_equipment(payload.get_equipment_id(source))
         return f"{equipment_data['name']}"
     except Exception:
         return "Данной техники нет в базе данных"
@@ -131,18 +132,36 @@ isoformat_to_informal = (
 
 def validate_qr_code(qr_code_data: str) -> bool:
     """
-    Validate control sum of the QR code
+    Validate signature or control sum of the QR code
     """
-    # get equipment id and control sum from the QR code data
-    split_data = qr_code_data.split()
-    if len(split_data) == 2 and qr_code_data.split()[0].isdigit():
-        equipment_id = int(qr_code_data.split()[0])
-        control_sum = qr_code_data.split()[1]
-        try:
-            return validate_control_sum(equipment_id, control_sum)
-        except Exception:
+    return bool(validate_qr_codes([qr_code_data]))
+
+
+def validate_qr_codes(codes: list) -> list:
+    """
+    Get codes of existing equipment with valid signature or control
+    sum, control values of all codes are read with one query
+    """
+    ids = [(code, payload.get_equipment_id(code)) for code in codes]
+    known = [equipment_id for _, equipment_id in ids if equipment_id is not None]
+    try:
+        controls = get_controls(known) if known else {}
+    except Exception:
+        logging.error("Error at validation of control sum")
+        return []
+    valid = []
+    for code, equipment_id in ids:
+        if equipment_id is None:
+            logging.error("Error at validation format")
+        elif equipment_id not in controls:
+            logging.error(f"Equipment {equipment_id} does not exist")
+        elif payload.is_signed(code):
+            if payload.verify(code, controls[equipment_id]):
+                valid.append(code)
+            else:
+                logging.error("Error at validation of signature")
+        elif payload.get_legacy_control(code) == controls[equipment_id]:
+            valid.append(code)
+        else:
             logging.error("Error at validation of control sum")
-            return False
-    else:
-        logging.error("Error at validation format")
-        return False
+    return valid
@@ -0,0 +1,166 @@
+"""
+FSM storage which keeps conversations in the database, so pending
+requests survive restarts of the bot
+"""
+import asyncio
+import contextlib
+import json
+import time
+import typing
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from api.cache import TTLCache
+from db.executor import run_in_db
+from db.models import FSMState
+
+
+def load_record(chat: int, user: int):
+    return (FSMState.select(FSMState.state, FSMState.data, FSMState.updated)
+            .where((FSMState.chat == chat) & (FSMState.user == user)).tuples().first())
+
+
+def save_record(chat: int, user: int, state: str, data: str, updated: float):
+    FSMState.replace(chat=chat, user=user, state=state, data=data, updated=updated).execute()
+
+
+def delete_record(chat: int, user: int):
+    FSMState.delete().where((FSMState.chat == chat) & (FSMState.user == user)).execute()
+
+
+def delete_expired(before: float) -> int:
+    return FSMState.delete().where(FSMState.updated < before).execute()
+
+
+def count_records(after: float) -> int:
+    return FSMState.select().where(FSMState.updated >= after).count()
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Records are written through to the database and read from
+    a bounded in-memory cache. Data is kept as JSON, so it must
+    contain only plain values like ids, not aiogram objects.
+    Conversations not updated for ttl seconds are dropped.
+    Calls for one conversation run one at a time, so they reach
+    the cache and the database in order
+    """
+
+    def __init__(self, ttl: float = 24 * 60 * 60, cache_size: int = 4096):
+        self._ttl = ttl
+        self._cache = TTLCache(cache_size, ttl)
+        # (chat, user): [lock, number of calls using it]
+        self._locks = {}
+        self._expired_at = 0
+        self.expired = 0
+
+    async def close(self):
+        self._cache.clear()
+
+    async def wait_closed(self):
+        pass
+
+    async def count(self) -> int:
+        """
+        Count conversations which are not finished and not expired
+        """
+        return await run_in_db(count_records, time.time() - self._ttl)
+
+    @contextlib.asynccontextmanager
+    async def _locked(self, chat: int, user: int):
+        key = (chat, user)
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            # locks of idle conversations are not kept
+            if not entry[1]:
+                del self._locks[key]
+
+    async def _get(self, chat: int, user: int) -> tuple:
+        """
+        Get (state, data as JSON) of the conversation
+        """
+        record = self._cache.get((chat, user))
+        if record is None:
+            row = await run_in_db(load_record, chat, user)
+            if row is None or row[2] < time.time() - self._ttl:
+                record = (None, '{}')
+            else:
+                record = row[:2]
+            self._cache.set((chat, user), record)
+        return record
+
+    async def _set(self, chat: int, user: int, state: str, data: str):
+        now = time.time()
+        self._cache.set((chat, user), (state, data))
+        if state is None and data == '{}':
+            # finished conversations are not kept
+            await run_in_db(delete_record, chat, user)
+        else:
+            await run_in_db(save_record, chat, user, state, data, now)
+        if now - self._expired_at > self._ttl / 24:
+            self._expired_at = now
+            self.expired += await run_in_db(delete_expired, now - self._ttl)
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        chat, user = map(int, self.check_address(chat=chat, user=user))
+        async with self._locked(chat, user):
+            state, _ = await self._get(chat, user)
+            return state if state is not None else default
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        chat, user = map(int, self.check_address(chat=chat, user=user))
+        async with self._locked(chat, user):
+            state, data = await self._get(chat, user)
+            if state is None and data == '{}' and default is not None:
+                # nothing is stored for the conversation
+                return default
+            return json.loads(data)
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        chat, user = map(int, self.check_address(chat=chat, user=user))
+        async with self._locked(chat, user):
+            _, data = await self._get(chat, user)
+            await self._set(chat, user, state, data)
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        chat, user = map(int, self.check_address(chat=chat, user=user))
+        async with self._locked(chat, user):
+            state, _ = await self._get(chat, user)
+            await self._set(chat, user, state, json.dumps(data or {}, separators=(',', ':')))
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None, **kwargs):
+        chat, user = map(int, self.check_address(chat=chat, user=user))
+        async with self._locked(chat, user):
+            state, current = await self._get(chat, user)
+            current = json.loads(current)
+            current.update(data or {}, **kwargs)
+            await self._set(chat, user, state, json.dumps(current, separators=(',', ':')))
+
+    async def reset_state(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          with_data: typing.Optional[bool] = True):
+        chat, user = map(int, self.check_address(chat=chat, user=user))
+        async with self._locked(chat, user):
+            _, data = await self._get(chat, user)
+            await self._set(chat, user, None, '{}' if with_data else data)
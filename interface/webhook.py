@@ -0,0 +1,144 @@
+"""
+Webhook mode: Telegram posts updates to the aiohttp server. Updates are
+acknowledged at once and handled in background tasks, on shutdown the
+server waits for the tasks which are still running.
+
+Updates are accepted only on a path with a secret, anyone who knows
+the path can post updates from any user
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+import time
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+
+from api.metrics import Counter, Gauge
+from interface.outbox import Outbox
+
+updates_total = Counter('webhook_updates_total', 'Updates received by the webhook by result', ['result'])
+updates_in_flight = Gauge('webhook_updates_in_flight', 'Updates which are being handled')
+
+
+class UpdateHandler:
+    """
+    Accept updates over HTTP and process them with the dispatcher
+    """
+
+    def __init__(self, dp: Dispatcher):
+        self._dp = dp
+        self._tasks = set()
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        try:
+            update = types.Update(**await request.json())
+        except (ValueError, TypeError):
+            return web.Response(status=400)
+        self.submit(update)
+        # answer before the update is handled, so Telegram doesn't resend it
+        return web.Response()
+
+    def submit(self, update: types.Update) -> asyncio.Task:
+        self.received += 1
+        updates_in_flight.inc()
+        task = asyncio.ensure_future(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        updates_in_flight.dec()
+
+    async def _process(self, update: types.Update):
+        Dispatcher.set_current(self._dp)
+        Bot.set_current(self._dp.bot)
+        try:
+            await self._dp.updates_handler.notify(update)
+        except Exception:
+            self.failed += 1
+            updates_total.labels('failed').inc()
+            logging.exception(f'[WEBHOOK] Update {update.update_id} failed')
+        else:
+            self.processed += 1
+            updates_total.labels('processed').inc()
+
+    async def drain(self, timeout: float = 30):
+        """
+        Wait for updates which are being handled
+        """
+        if not self._tasks:
+            return
+        logging.info(f'[WEBHOOK] Waiting for {len(self._tasks)} updates')
+        start = time.monotonic()
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        logging.info(f'[WEBHOOK] Drained in {time.monotonic() - start:.1f}s, '
+                     f'{len(pending)} updates left unfinished')
+
+    def __str__(self):
+        return (f'{self.received} received, {self.processed} processed, '
+                f'{self.failed} failed, {self.in_flight} in flight')
+
+
+def derive_secret(token: str) -> str:
+    """
+    Secret of the webhook path made from the bot token
+    """
+    return hmac.new(token.encode(), b'webhook', hashlib.sha256).hexdigest()
+
+
+def secret_path(path: str, secret: str) -> str:
+    if not secret:
+        raise ValueError('Webhook needs a secret, updates could be forged without it')
+    return f"{path.rstrip('/')}/{secret}"
+
+
+def create_app(dp: Dispatcher, path: str, secret: str, url: str = None, outbox: Outbox = None,
+               drain_timeout: float = 30) -> web.Application:
+    """
+    Create aiohttp application which receives updates on the path
+    followed by the secret. The webhook is set to the url with the
+    secret on startup if it is given
+    """
+    handler = UpdateHandler(dp)
+    app = web.Application()
+    app['update_handler'] = handler
+    app.router.add_post(secret_path(path, secret), handler.handle)
+
+    async def on_startup(app: web.Application):
+        if url is not None:
+            await dp.bot.set_webhook(secret_path(url, secret))
+            # the secret is not written to the log
+            logging.info(f'[WEBHOOK] Receiving updates on {url}')
+
+    async def on_shutdown(app: web.Application):
+        # the webhook stays set, Telegram keeps updates until the bot is back
+        await handler.drain(drain_timeout)
+        if outbox is not None:
+            await outbox.close()
+        await dp.storage.close()
+        await dp.storage.wait_closed()
+        await dp.bot.session.close()
+        logging.info(f'[WEBHOOK] Stopped: {handler}')
+
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    return app
+
+
+def start_webhook(dp: Dispatcher, url: str, path: str, secret: str, host: str = '0.0.0.0',
+                  port: int = 8080, outbox: Outbox = None, drain_timeout: float = 30,
+                  on_startup=None):
+    app = create_app(dp, path, secret, url, outbox, drain_timeout)
+    if on_startup is not None:
+        app.on_startup.append(on_startup)
+    web.run_app(app, host=host, port=port)